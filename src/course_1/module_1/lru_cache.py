@@ -1,27 +1,365 @@
+import builtins
+import functools
+import hashlib
+import pickle
+import sys
+import threading
+import time
+import types
 import unittest.mock
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from typing import Callable
+from timeit import timeit
+from typing import Any, Callable, NamedTuple
 
+import redis
 
-def lru_cache(func: Callable | None = None, *, maxsize: int | None = None):
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    currsize: int
+    maxsize: int | None
+    currbytes: int = 0
+    maxbytes: int | None = None
+    l2_hits: int = 0
+    l2_misses: int = 0
+
+
+class RedisBackend:
+    """
+    Общий для всех процессов второй уровень кэша в Redis
+    """
+
+    def __init__(self, redis_connection: redis.Redis, prefix: str = "lru_cache:"):
+        self.redis = redis_connection
+        self.prefix = prefix
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            return self.redis.get(f"{self.prefix}{key}")
+        except redis.RedisError:
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        px = int(ttl * 1000) if ttl is not None else None
+        try:
+            self.redis.set(f"{self.prefix}{key}", value, px=px)
+        except redis.RedisError:
+            pass
+
+
+class _HashedSeq(list):
+    """
+    Ключ кэша, который вычисляет хэш один раз при создании
+    """
+
+    __slots__ = ("hashvalue",)
+
+    def __init__(self, tup: tuple):
+        self[:] = tup
+        self.hashvalue = hash(tup)
+
+    def __hash__(self) -> int:  # type: ignore[override]
+        return self.hashvalue
+
+
+_KWD_MARK = object()
+_MISSING = object()
+_FAST_TYPES = frozenset({int, str})
+_SERIALIZE_ERRORS = (pickle.PicklingError, TypeError, ValueError, AttributeError)
+
+
+def make_key(args: tuple, kwargs: dict, typed: bool = False) -> Any:
+    """
+    Строит ключ кэша из аргументов вызова по образцу functools._make_key.
+
+    Единственный аргумент типа int или str используется как ключ напрямую,
+    остальные ключи оборачиваются в _HashedSeq с заранее посчитанным хэшем.
+    Именованные аргументы попадают в ключ одним кортежем: сначала имена,
+    потом значения, без промежуточного кортежа на каждый аргумент
+    """
+    if not kwargs and not typed:
+        if len(args) == 1 and type(args[0]) in _FAST_TYPES:
+            return args[0]
+        return _HashedSeq(args)
+    key = (*args, _KWD_MARK, *kwargs, *kwargs.values()) if kwargs else args
+    if typed:
+        key += (*map(type, args), *map(type, kwargs.values()))
+    return _HashedSeq(key)
+
+
+_SHARED_TYPES = (
+    types.ModuleType,
+    type,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+)
+
+
+def deep_getsizeof(obj: Any, seen: set[int] | None = None) -> int:
+    """
+    Оценивает размер объекта в байтах, обходя контейнеры через явный стек,
+    чтобы глубокая вложенность не упиралась в лимит рекурсии. Модули,
+    классы и функции общие для всей программы и не принадлежат записи,
+    поэтому не учитываются
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, bytearray, int, float)):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(vars(obj))
+    return size
+
+
+def lru_cache(
+    func: Callable | None = None,
+    *,
+    maxsize: int | None = None,
+    maxbytes: int | None = None,
+    sizer: Callable[[Any], int] = deep_getsizeof,
+    typed: bool = False,
+    ttl: float | None = None,
+    sweep_interval: float | None = None,
+    clock: Callable[[], float] = time.monotonic,
+    l2: Any = None,
+    serializer: Any = pickle,
+):
+    """
+    Кэширует результаты вызовов функции.
+
+    Если typed=True, аргументы разных типов кэшируются отдельно,
+    например f(3) и f(3.0).
+
+    Если задан maxbytes, каждая запись взвешивается функцией sizer, и самые
+    старые записи вытесняются, пока суммарный вес не станет меньше maxbytes.
+    Если задан ttl, запись живёт ttl секунд по часам clock и удаляется
+    лениво при обращении к ней. Если задан sweep_interval, не чаще раза
+    в sweep_interval секунд при вызове удаляются все просроченные записи,
+    без ttl sweep_interval не имеет смысла и вызывает ValueError.
+
+    Если задан l2 (объект с методами get(key) и set(key, value, ttl),
+    например RedisBackend), промах в локальном кэше сначала проверяет l2,
+    и только потом вызывает функцию. Значения в l2 сериализуются объектом
+    serializer с методами dumps/loads. Ключ l2 - хэш аргументов, сериализованных
+    тем же serializer, поэтому равные аргументы дают один ключ во всех
+    процессах. Вызовы, аргументы или результат которых не сериализуются,
+    идут мимо l2
+    """
+    if sweep_interval is not None and ttl is None:
+        raise ValueError("sweep_interval requires ttl")
     if func is None:
-        return lambda f: lru_cache(f, maxsize=maxsize)
+        return lambda f: lru_cache(
+            f,
+            maxsize=maxsize,
+            maxbytes=maxbytes,
+            sizer=sizer,
+            typed=typed,
+            ttl=ttl,
+            sweep_interval=sweep_interval,
+            clock=clock,
+            l2=l2,
+            serializer=serializer,
+        )
 
     cache: OrderedDict = OrderedDict()
+    cache_get = cache.get
+    move_to_end = cache.move_to_end
+    get_ident = threading.get_ident
+    sizes: dict = {}
+    lock = threading.Lock()
+    # Попадания считаются без блокировки, каждый поток в своей ячейке
+    hit_counts: dict[int, int] = {}
+    # Путь попадания без блокировки опирается на GIL. В сборке без GIL
+    # (3.13t) попадания берут блокировку, как и остальные операции
+    lock_free = getattr(sys, "_is_gil_enabled", lambda: True)()
+    misses = evictions = currbytes = 0
+    l2_hits = l2_misses = 0
+    l2_prefix = f"{func.__module__}.{func.__qualname__}:" if l2 is not None else ""
+    last_sweep = clock()
+
+    def discard(key) -> None:
+        """
+        Удаляет запись из кэша. Вызывается под блокировкой
+        """
+        nonlocal currbytes
+        del cache[key]
+        if maxbytes is not None:
+            currbytes -= sizes.pop(key)
+
+    def sweep(now: float) -> None:
+        """
+        Удаляет из кэша все просроченные записи. Вызывается под блокировкой
+        """
+        # Копия снимается одним вызовом C, потому что попадания
+        # без блокировки двигают записи
+        items = list(cache.items())
+        expired = [key for key, (expires_at, _) in items if expires_at <= now]
+        for key in expired:
+            discard(key)
+
+    def overflow() -> bool:
+        """
+        Проверяет, превышены ли ограничения кэша. Вызывается под блокировкой
+        """
+        if maxsize is not None and len(cache) > maxsize:
+            return True
+        return maxbytes is not None and currbytes > maxbytes
+
+    def make_l2_key(args: tuple, kwargs: dict) -> str | None:
+        """
+        Строит ключ l2 из сериализованных аргументов. repr для этого не годится:
+        в repr объекта по умолчанию стоит адрес, который после удаления объекта
+        достаётся другому, а repr больших массивов обрезается. Возвращает None,
+        если аргументы не сериализуются
+        """
+        try:
+            raw_key = serializer.dumps((args, tuple(sorted(kwargs.items()))))
+        except _SERIALIZE_ERRORS:
+            return None
+        if isinstance(raw_key, str):
+            raw_key = raw_key.encode()
+        return l2_prefix + hashlib.sha1(raw_key).hexdigest()
+
+    def call(args: tuple, kwargs: dict) -> Any:
+        """
+        Берёт значение из l2 или вызывает функцию и сохраняет результат в l2
+        """
+        nonlocal l2_hits, l2_misses
+        l2_key = make_l2_key(args, kwargs) if l2 is not None else None
+        if l2_key is None:
+            return func(*args, **kwargs)
+        data = l2.get(l2_key)
+        if data is not None:
+            with lock:
+                l2_hits += 1
+            return serializer.loads(data)
+        result = func(*args, **kwargs)
+        try:
+            l2.set(l2_key, serializer.dumps(result), ttl)
+        except _SERIALIZE_ERRORS:
+            pass
+        with lock:
+            l2_misses += 1
+        return result
+
+    def count_hit() -> None:
+        """
+        Считает попадание в ячейке текущего потока. Ячейку пишет только
+        её поток, поэтому под GIL обновления не теряются и без блокировки
+        """
+        ident = get_ident()
+        hit_counts[ident] = hit_counts.get(ident, 0) + 1
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        key = (args, tuple(sorted(kwargs.items())))
-        if key in cache:
-            cache.move_to_end(key)
-            return cache[key]
-        result = func(*args, **kwargs)
-        cache[key] = result
-        if maxsize is not None and len(cache) > maxsize:
-            cache.popitem(last=False)
+        nonlocal misses, evictions, currbytes, last_sweep
+        key = make_key(args, kwargs, typed)
+        now = clock() if ttl is not None else 0.0
+        if sweep_interval is not None and now - last_sweep >= sweep_interval:
+            with lock:
+                if now - last_sweep >= sweep_interval:
+                    sweep(now)
+                    last_sweep = now
+        # Попадание обходится без блокировки: get и move_to_end у OrderedDict
+        # выполняются одним вызовом C и атомарны под GIL
+        entry = cache_get(key, _MISSING) if lock_free else _MISSING
+        if entry is not _MISSING and (ttl is None or entry[0] > now):
+            try:
+                move_to_end(key)
+            except KeyError:
+                # Запись только что вытеснил другой поток, значение ещё верно
+                pass
+            ident = get_ident()
+            hit_counts[ident] = hit_counts.get(ident, 0) + 1
+            return entry if ttl is None else entry[1]
+        with lock:
+            entry = cache.get(key, _MISSING)
+            if entry is not _MISSING:
+                if ttl is None or entry[0] > now:
+                    # Пока ждали блокировку, другой поток положил значение
+                    cache.move_to_end(key)
+                    count_hit()
+                    return entry if ttl is None else entry[1]
+                discard(key)
+            misses += 1
+        # Функция вызывается вне блокировки, чтобы медленный вызов
+        # не останавливал остальные потоки
+        result = call(args, kwargs)
+        size = sizer(key) + sizer(result) if maxbytes is not None else 0
+        with lock:
+            if ttl is None:
+                entry = cache.get(key, _MISSING)
+                if entry is not _MISSING:
+                    # Пока считали, другой поток уже положил значение
+                    cache.move_to_end(key)
+                    return entry
+                cache[key] = result
+            else:
+                if key in cache:
+                    discard(key)
+                cache[key] = (now + ttl, result)
+            if maxbytes is not None:
+                sizes[key] = size
+                currbytes += size
+            while cache and overflow():
+                # popitem - один вызов C, в отличие от next(iter(cache)),
+                # поэтому попадание без блокировки не может вклиниться
+                oldest, _ = cache.popitem(last=False)
+                if maxbytes is not None:
+                    currbytes -= sizes.pop(oldest)
+                evictions += 1
         return result
 
+    def cache_info() -> CacheInfo:
+        """
+        Возвращает статистику работы кэша
+        """
+        with lock:
+            return CacheInfo(
+                builtins.sum(hit_counts.values()),
+                misses,
+                evictions,
+                len(cache),
+                maxsize,
+                currbytes,
+                maxbytes,
+                l2_hits,
+                l2_misses,
+            )
+
+    def cache_clear() -> None:
+        """
+        Очищает локальный кэш и сбрасывает статистику. Общий l2 не очищается,
+        так как им пользуются другие процессы
+        """
+        nonlocal misses, evictions, currbytes, l2_hits, l2_misses
+        with lock:
+            cache.clear()
+            sizes.clear()
+            hit_counts.clear()
+            misses = evictions = currbytes = 0
+            l2_hits = l2_misses = 0
+
+    wrapper.cache_info = cache_info  # type: ignore[attr-defined]
+    wrapper.cache_clear = cache_clear  # type: ignore[attr-defined]
     return wrapper
 
 
@@ -40,6 +378,93 @@ def multiply(a: int, b: int) -> int:
     return a * b
 
 
+def stress_test(
+    threads: int = 16,
+    calls: int = 20_000,
+    maxsize: int = 64,
+    ttl: float | None = None,
+) -> None:
+    """
+    Нагружает кэш из нескольких потоков и проверяет его целостность.
+    С ttl записи истекают и вычищаются прямо во время попаданий
+    """
+    decorated = lru_cache(maxsize=maxsize, ttl=ttl, sweep_interval=ttl)(lambda a: a * 2)
+
+    def run(seed: int) -> None:
+        for i in range(calls):
+            value = (seed * 7 + i) % (maxsize * 2)
+            assert decorated(value) == value * 2
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        tuple(executor.map(run, range(threads)))
+
+    info = decorated.cache_info()
+    assert info.hits + info.misses == threads * calls
+    assert info.currsize <= maxsize
+    assert info.currsize <= info.misses - info.evictions
+
+
+def benchmark(number: int = 200_000) -> None:
+    """
+    Сравнивает скорость с functools.lru_cache
+    """
+
+    def func(a: int, b: int) -> int:
+        return a + b
+
+    candidates = {
+        "lru_cache": lru_cache(maxsize=128)(func),
+        "functools.lru_cache": functools.lru_cache(maxsize=128)(func),
+    }
+    for title, decorated in candidates.items():
+        elapsed = timeit(functools.partial(decorated, 1, 2), number=number)
+        print(f"{title:<20} {number / elapsed:>12,.0f} calls/s")
+
+
+def benchmark_key(number: int = 500_000) -> None:
+    """
+    Сравнивает ключи до и после make_key на пути попадания в кэш:
+    построение ключа, поиск в OrderedDict и move_to_end
+    """
+    candidates = {
+        "sorted tuple": lambda args, kwargs: (args, tuple(sorted(kwargs.items()))),
+        "make_key": make_key,
+    }
+    calls = (
+        ((1,), {}),
+        ((1, 2), {}),
+        (("usd",), {"amount": 2}),
+        (("usd",), {"amount": 2, "target": "eur", "precision": 6}),
+    )
+
+    def hit(build: Callable, table: OrderedDict, args: tuple, kwargs: dict) -> None:
+        key = build(args, kwargs)
+        table.get(key)
+        table.move_to_end(key)
+
+    for args, kwargs in calls:
+        for title, build in candidates.items():
+            table = OrderedDict({build(args, kwargs): None})
+            call = functools.partial(hit, build, table, args, kwargs)
+            elapsed = timeit(call, number=number)
+            label = f"{args} {kwargs}"
+            print(f"{title:<14} {label:<24} {number / elapsed:>12,.0f} calls/s")
+
+
+def benchmark_sizer(number: int = 20_000) -> None:
+    """
+    Замеряет накладные расходы на взвешивание записей при промахах
+    """
+    payload = {"rates": {str(i): i / 3 for i in range(100)}}
+    candidates = {
+        "maxsize": lru_cache(maxsize=1)(lambda a: payload),
+        "maxbytes": lru_cache(maxbytes=1)(lambda a: payload),
+    }
+    for title, decorated in candidates.items():
+        elapsed = timeit(lambda d=decorated: d(object()), number=number)
+        print(f"{title:<20} {elapsed / number * 1e6:>12.2f} us/miss")
+
+
 if __name__ == "__main__":
     assert sum(1, 2) == 3
     assert sum(3, 4) == 7
@@ -61,3 +486,118 @@ if __name__ == "__main__":
     assert decorated(5, 6) == 3
     assert decorated(1, 2) == 4
     assert mocked_func.call_count == 4
+    assert decorated.cache_info() == CacheInfo(
+        hits=3, misses=4, evictions=2, currsize=2, maxsize=2
+    )
+
+    decorated.cache_clear()
+    assert decorated.cache_info() == CacheInfo(0, 0, 0, 0, 2)
+
+    now = 0.0
+    mocked_func = unittest.mock.Mock(side_effect=[1, 2, 3])
+    decorated = lru_cache(ttl=10, clock=lambda: now)(mocked_func)
+    assert decorated("usd") == 1
+    now = 9.9
+    assert decorated("usd") == 1
+    now = 10.0
+    assert decorated("usd") == 2
+    assert decorated.cache_info().misses == 2
+
+    now = 0.0
+    mocked_func = unittest.mock.Mock(side_effect=lambda a: a)
+    decorated = lru_cache(ttl=1, sweep_interval=5, clock=lambda: now)(mocked_func)
+    for i in range(10):
+        decorated(i)
+    now = 4.0
+    decorated(100)
+    assert decorated.cache_info().currsize == 11
+    now = 5.0
+    decorated(101)
+    assert decorated.cache_info().currsize == 1
+
+    try:
+        lru_cache(sweep_interval=5)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("sweep_interval without ttl must be rejected")
+
+    mocked_func = unittest.mock.Mock(side_effect=lambda a: "x" * a)
+    decorated = lru_cache(
+        maxbytes=3000,
+        sizer=lambda obj: len(obj) if isinstance(obj, str) else 2,
+    )(mocked_func)
+    decorated(1000)
+    decorated(1000)
+    decorated(1500)
+    assert decorated.cache_info().currbytes == 2504
+    decorated(1000)
+    decorated(800)
+    info = decorated.cache_info()
+    assert info.currsize == 2
+    assert info.currbytes == 1804
+    assert info.evictions == 1
+    assert deep_getsizeof([b"a" * 100]) > 100
+    assert deep_getsizeof(types.SimpleNamespace(module=functools)) < 1000
+    nested: list = []
+    for _ in range(5000):
+        nested = [nested]
+    assert deep_getsizeof(nested) > 5000 * 56
+
+    # Частое переключение потоков вскрывает гонки между попаданиями
+    # без блокировки и вытеснением
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    stress_test()
+    stress_test(ttl=0.001)
+    sys.setswitchinterval(switch_interval)
+    mocked_func = unittest.mock.Mock(side_effect=[1, 2, 3])
+    decorated = lru_cache(typed=True)(mocked_func)
+    assert decorated(3) == 1
+    assert decorated(3.0) == 2
+    assert decorated(3) == 1
+    assert decorated(a=3) == 3
+    assert make_key((1,), {}) == 1
+    assert make_key((1, 2), {}) == [1, 2]
+    assert type(make_key((1, 2), {})) is _HashedSeq
+    assert make_key((1,), {"b": 2, "c": 3}) == [1, _KWD_MARK, "b", "c", 2, 3]
+    assert make_key((1,), {"b": 2, "c": 3}) != make_key((1,), {"c": 2, "b": 3})
+    assert make_key((1,), {}, typed=True) != make_key((1.0,), {}, typed=True)
+    assert make_key((1,), {"b": 2}) != make_key((1, "b", 2), {})
+
+    storage: dict = {}
+    backend = unittest.mock.Mock()
+    backend.get.side_effect = storage.get
+    backend.set.side_effect = lambda key, value, ttl: storage.__setitem__(key, value)
+    calls = []
+
+    def get_rates(currency: str) -> dict:
+        calls.append(currency)
+        return {currency: 1.0}
+
+    first = lru_cache(l2=backend)(get_rates)
+    second = lru_cache(l2=backend)(get_rates)
+    assert first("usd") == {"usd": 1.0}
+    assert second("usd") == {"usd": 1.0}
+    assert second("usd") == {"usd": 1.0}
+    assert calls == ["usd"]
+    assert first.cache_info().l2_misses == 1
+    info = second.cache_info()
+    assert (info.hits, info.misses, info.l2_hits, info.l2_misses) == (1, 1, 1, 0)
+
+    class Order:
+        def __init__(self, total: int):
+            self.total = total
+
+    storage.clear()
+    get_total = lru_cache(maxsize=1, l2=backend)(lambda order: order.total)
+    # Адреса удалённых объектов переиспользуются, repr с адресом
+    # давал один ключ l2 для разных заказов
+    assert all(get_total(Order(i)) == i for i in range(200))
+    get_callable = lru_cache(l2=backend)(lambda value: value)
+    assert get_callable(len) is len
+    assert get_callable(lambda: 2)() == 2
+
+    benchmark()
+    benchmark_key()
+    benchmark_sizer()
@@ -0,0 +1,81 @@
+import asyncio
+from collections import deque
+from collections.abc import Callable
+from time import perf_counter
+
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+INITIAL_LIMIT = 5
+BACKOFF = 0.5
+LATENCY_TOLERANCE = 2.0
+# Хранятся только последние изменения лимита, чтобы долгий прогон
+# не копил историю без границы
+HISTORY_SIZE = 1024
+
+
+class AdaptiveLimiter:
+    """
+    Ограничитель параллельных запросов по схеме AIMD. Пока задержка
+    не выше минимальной наблюдённой в tolerance раз и нет ошибок,
+    лимит растёт примерно на единицу за каждый полный круг запросов.
+    На таймаут, 429 или 5xx лимит умножается на backoff, но не чаще
+    одного раза за время ответа, чтобы одна волна ошибок не обнулила его
+    """
+
+    def __init__(
+        self,
+        min_limit: int = MIN_LIMIT,
+        max_limit: int = MAX_LIMIT,
+        initial: int = INITIAL_LIMIT,
+        backoff: float = BACKOFF,
+        tolerance: float = LATENCY_TOLERANCE,
+        clock: Callable[[], float] = perf_counter,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.clock = clock
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self.min_latency: float | None = None
+        self.last_decrease = float("-inf")
+        self.started = clock()
+        self.history: deque[tuple[float, int]] = deque(
+            [(0.0, int(self.limit))], maxlen=HISTORY_SIZE
+        )
+        self.condition = asyncio.Condition()
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.current)
+            self.in_flight += 1
+
+    async def release(self, latency: float, status: int) -> None:
+        """
+        Освобождает слот и пересчитывает лимит по результату запроса.
+        Статус 0 означает таймаут или ошибку соединения
+        """
+        async with self.condition:
+            self.in_flight -= 1
+            self.update(latency, status)
+            self.condition.notify_all()
+
+    def update(self, latency: float, status: int) -> None:
+        previous = self.current
+        now = self.clock()
+        if status == 0 or status == 429 or status >= 500:
+            if now - self.last_decrease >= latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+        else:
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            if latency <= self.min_latency * self.tolerance:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        if self.current != previous:
+            self.history.append((now - self.started, self.current))
@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import AsyncExitStack, asynccontextmanager
+from time import perf_counter
+
+import aiofiles
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+
+@asynccontextmanager
+async def stub_server(
+    body_size: int = 1024,
+    host: str = HOST,
+    port: int = PORT,
+    delay: float = 0.0,
+    capacity: int | None = None,
+) -> AsyncIterator[str]:
+    """
+    Поднимает локальный сервер, который через delay секунд отвечает
+    JSON-телом примерно body_size байт с заголовком ETag и отвечает 304
+    на совпадающий If-None-Match. Путь /status/<code> отвечает указанным
+    статусом. Если задан capacity, сервер отвечает 503 на запросы сверх
+    capacity одновременных, а задержка растёт с числом запросов в работе
+    """
+    body = json.dumps({"data": "x" * body_size}).encode()
+    etag = f'"{body_size}"'
+    in_flight = 0
+
+    async def handle_json(request: web.Request) -> web.Response:
+        nonlocal in_flight
+        if capacity is not None:
+            if in_flight >= capacity:
+                return web.Response(status=503)
+            in_flight += 1
+            try:
+                await asyncio.sleep(delay * (1 + in_flight / capacity))
+            finally:
+                in_flight -= 1
+        elif delay:
+            await asyncio.sleep(delay)
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(
+            body=body,
+            content_type="application/json",
+            headers={"ETag": etag},
+        )
+
+    async def handle_status(request: web.Request) -> web.Response:
+        return web.Response(status=int(request.match_info["code"]))
+
+    app = web.Application()
+    app.router.add_get("/status/{code}", handle_status)
+    app.router.add_get("/{tail:.*}", handle_json)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        await runner.cleanup()
+
+
+def write_urls(file_path: str, base_url: str, count: int) -> None:
+    """
+    Пишет в файл count разных url стаб-сервера
+    """
+    with open(file_path, "w", encoding="utf-8") as file:
+        for i in range(count):
+            file.write(f"{base_url}/item/{i}\n")
+
+
+async def fetch_urls_temp_files(urls_path: str, result_path: str) -> Counter:
+    """
+    Прежний путь fetch_ulrs_from_file: каждый ответ пишется в свой
+    временный файл, а в конце файлы перечитываются, разбираются
+    и заново сериализуются в result_path. Временные файлы удаляются
+    здесь же, чтобы бенчмарк не оставлял мусор
+    """
+    from fetch_ulrs_from_file import LIMIT, TIMEOUT
+
+    stats: Counter = Counter()
+    tmp_files: dict[str, str] = {}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+
+    async def handler(session: ClientSession) -> None:
+        while True:
+            url = await queue.get()
+            try:
+                async with session.get(url) as response:
+                    if response.status != 200:
+                        continue
+                    async with aiofiles.tempfile.NamedTemporaryFile(
+                        "wb+", delete=False
+                    ) as tmp_file:
+                        # Размер части такой же, как был в прежнем коде
+                        async for chunk in response.content.iter_chunked(1024):
+                            await tmp_file.write(chunk)
+                            stats["spilled_bytes"] += len(chunk)
+                        tmp_files[url] = str(tmp_file.name)
+            finally:
+                queue.task_done()
+
+    timeout = ClientTimeout(total=TIMEOUT)
+    async with ClientSession(
+        connector=TCPConnector(limit=LIMIT), timeout=timeout
+    ) as session:
+        workers = [asyncio.create_task(handler(session)) for _ in range(LIMIT)]
+        async with aiofiles.open(urls_path, "r", encoding="utf-8") as urls_file:
+            async for line in urls_file:
+                await queue.put(line.strip())
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+
+    async with aiofiles.open(result_path, "a", encoding="utf-8") as result:
+        for url, tmp_file_path in tmp_files.items():
+            async with aiofiles.open(tmp_file_path, "r", encoding="utf-8") as file:
+                content = json.loads(await file.read())
+            line = json.dumps({"url": url, "content": content}) + "\n"
+            await result.write(line)
+            stats["result_bytes"] += len(line)
+            os.remove(tmp_file_path)
+    return stats
+
+
+async def benchmark_from_file(args: argparse.Namespace) -> None:
+    """
+    Замеряет время и объём записи на диск для fetch_ulrs_from_file
+    и для прежнего пути через временный файл на каждый url
+    """
+    from fetch_ulrs_from_file import fetch_urls
+
+    count, body_size = args.count, args.body_size
+    flows = {"temp_files": fetch_urls_temp_files, "stream": fetch_urls}
+    async with stub_server(body_size) as base_url:
+        for title, fetch in flows.items():
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                urls_path = os.path.join(tmp_dir, "urls.txt")
+                result_path = os.path.join(tmp_dir, "results.jsonl")
+                write_urls(urls_path, base_url, count)
+                start = perf_counter()
+                stats = await fetch(urls_path, result_path)
+                elapsed = perf_counter() - start
+            disk_bytes = stats["result_bytes"] + stats["spilled_bytes"]
+            print(
+                f"{title}: {count} urls x {body_size} B, {elapsed:.3f} s, "
+                f"{disk_bytes} B written ({stats['spilled_bytes']} B spilled)"
+            )
+
+
+async def benchmark_hosts(args: argparse.Namespace) -> None:
+    """
+    Сравнивает пропускную способность по хостам на смешанном списке url,
+    где один хост из четырёх медленный, с ограничением на хост и без него
+    """
+    from fetch_urls import fetch_urls_stream
+    from host_scheduler import HostScheduler
+
+    limit = 8
+    async with AsyncExitStack() as stack:
+        base_urls = [
+            await stack.enter_async_context(
+                stub_server(args.body_size, port=PORT + i, delay=0.2 if i == 0 else 0)
+            )
+            for i in range(4)
+        ]
+        urls = [f"{base_urls[i % len(base_urls)]}/item/{i}" for i in range(args.count)]
+        for title, per_host_limit in (("shared", limit), ("per_host", 2)):
+            scheduler = HostScheduler(per_host_limit=per_host_limit)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                start = perf_counter()
+                await fetch_urls_stream(
+                    urls,
+                    os.path.join(tmp_dir, "results.jsonl"),
+                    limit=limit,
+                    scheduler=scheduler,
+                )
+                elapsed = perf_counter() - start
+            print(f"{title}: {args.count} urls, {elapsed:.3f} s")
+            for host, requests, throughput in scheduler.report():
+                print(f"    {host}: {requests} requests, {throughput:.1f} req/s")
+
+
+async def benchmark_validation(args: argparse.Namespace) -> None:
+    """
+    Дважды обходит один список url с кэшем валидаторов и показывает
+    долю попаданий и сэкономленные байты
+    """
+    from fetch_ulrs_from_file import fetch_urls
+
+    async with stub_server(args.body_size) as base_url:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            urls_path = os.path.join(tmp_dir, "urls.txt")
+            result_path = os.path.join(tmp_dir, "results.jsonl")
+            cache_path = os.path.join(tmp_dir, "http_cache.sqlite3")
+            write_urls(urls_path, base_url, args.count)
+            for run in ("cold", "warm"):
+                start = perf_counter()
+                stats = await fetch_urls(urls_path, result_path, cache_path=cache_path)
+                elapsed = perf_counter() - start
+                requests = stats["cache_hits"] + stats["cache_misses"]
+                print(
+                    f"{run}: {elapsed:.3f} s, "
+                    f"hit rate {stats['cache_hits'] / requests:.0%}, "
+                    f"{stats['bytes_saved']} B saved"
+                )
+
+
+async def benchmark_codecs(args: argparse.Namespace) -> None:
+    """
+    Сравнивает скорость записи и размер файла результатов для разных
+    кодеков на одном и том же наборе ответов стаб-сервера
+    """
+    from compressed_sink import CODECS, zstandard
+    from fetch_urls import fetch_urls_stream
+    from host_scheduler import HostScheduler
+
+    async with stub_server(args.body_size) as base_url:
+        urls = [f"{base_url}/item/{i}" for i in range(args.count)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for codec in CODECS:
+                if codec == "zstd" and zstandard is None:
+                    print("zstd: skipped, zstandard is not installed")
+                    continue
+                path = os.path.join(tmp_dir, f"results.{codec}")
+                start = perf_counter()
+                await fetch_urls_stream(
+                    urls,
+                    path,
+                    limit=8,
+                    scheduler=HostScheduler(per_host_limit=8),
+                    codec=codec,
+                )
+                elapsed = perf_counter() - start
+                print(
+                    f"{codec}: {args.count / elapsed:.0f} urls/s, "
+                    f"{os.path.getsize(path)} B on disk"
+                )
+
+
+async def benchmark_metrics(args: argparse.Namespace) -> None:
+    """
+    Показывает стоимость инструментирования: время одной пары
+    start/finish и общее время загрузки с метриками и без
+    """
+    from fetch_urls import fetch_urls_stream
+    from host_scheduler import HostScheduler
+    from metrics import FetchMetrics
+
+    metrics = FetchMetrics()
+    number = 100_000
+    start = perf_counter()
+    for _ in range(number):
+        metrics.finish(metrics.start(), 200)
+    print(f"start+finish: {(perf_counter() - start) / number * 1e9:.0f} ns")
+
+    async with stub_server(args.body_size) as base_url:
+        urls = [f"{base_url}/item/{i}" for i in range(args.count)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for title, enabled in (("without", False), ("with", True)):
+                start = perf_counter()
+                await fetch_urls_stream(
+                    urls,
+                    os.path.join(tmp_dir, "results.jsonl"),
+                    limit=8,
+                    scheduler=HostScheduler(per_host_limit=8),
+                    metrics=FetchMetrics() if enabled else None,
+                )
+                elapsed = perf_counter() - start
+                print(f"{title} metrics: {args.count / elapsed:.0f} urls/s")
+
+
+async def benchmark_aimd(args: argparse.Namespace) -> None:
+    """
+    Показывает, как AdaptiveLimiter подбирает лимит против сервера,
+    который выдерживает 20 одновременных запросов
+    """
+    from adaptive_limiter import AdaptiveLimiter
+    from fetch_urls import fetch_urls_stream
+    from host_scheduler import HostScheduler
+
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=100, initial=5)
+    async with stub_server(args.body_size, delay=0.01, capacity=20) as base_url:
+        urls = [f"{base_url}/item/{i}" for i in range(args.count)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = perf_counter()
+            await fetch_urls_stream(
+                urls,
+                os.path.join(tmp_dir, "results.jsonl"),
+                scheduler=HostScheduler(per_host_limit=limiter.max_limit),
+                limiter=limiter,
+            )
+            elapsed = perf_counter() - start
+    print(f"aimd: {args.count} urls, {elapsed:.3f} s, final limit {limiter.current}")
+    step = max(len(limiter.history) // 20, 1)
+    for moment, limit in list(limiter.history)[::step]:
+        print(f"    {moment:7.3f} s: {limit}")
+
+
+BENCHMARKS = {
+    "from_file": benchmark_from_file,
+    "hosts": benchmark_hosts,
+    "validation": benchmark_validation,
+    "codecs": benchmark_codecs,
+    "metrics": benchmark_metrics,
+    "aimd": benchmark_aimd,
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарки загрузчиков url")
+    parser.add_argument("name", choices=BENCHMARKS)
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--body-size", type=int, default=1024)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(BENCHMARKS[args.name](args))
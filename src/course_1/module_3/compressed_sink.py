@@ -0,0 +1,146 @@
+import asyncio
+import zlib
+
+import aiofiles
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOCK_SIZE = 1024 * 1024
+CODECS = ("none", "gzip", "zstd")
+
+
+class CompressedWriter:
+    """
+    Асинхронный файл, который сжимает записываемый текст на лету.
+    Сжатие и запись на диск выполняются в отдельном потоке, чтобы
+    не останавливать цикл событий. После каждых block_size байт
+    исходного текста сжатый блок сбрасывается на диск целиком, поэтому
+    уже записанную часть файла можно распаковать, даже если запись
+    оборвётся. В режиме "a" в конец файла дописывается новый поток
+    сжатия: и gzip, и zstd читают склеенные потоки как один
+    """
+
+    def __init__(
+        self,
+        path: str,
+        codec: str = "gzip",
+        mode: str = "w",
+        level: int | None = None,
+        block_size: int = BLOCK_SIZE,
+    ):
+        self.path = path
+        self.codec = codec
+        self.mode = mode
+        self.level = level
+        self.block_size = block_size
+        self.buffer: list[bytes] = []
+        self.buffered = 0
+        self.since_block = 0
+        self.lock = asyncio.Lock()
+
+    def _make_compressor(self):
+        if self.codec == "gzip":
+            level = self.level if self.level is not None else 6
+            # wbits=31 - формат gzip, а не голый zlib
+            return zlib.compressobj(level, zlib.DEFLATED, 31)
+        if self.codec == "zstd":
+            if zstandard is None:
+                raise ValueError("zstd codec requires the zstandard package")
+            level = self.level if self.level is not None else 3
+            return zstandard.ZstdCompressor(level=level).compressobj()
+        raise ValueError(f"Unknown codec: {self.codec}")
+
+    def _block_flush_mode(self) -> int:
+        if self.codec == "gzip":
+            return zlib.Z_SYNC_FLUSH
+        return zstandard.COMPRESSOBJ_FLUSH_BLOCK
+
+    def _compress(self, data: bytes, flush_block: bool, sync: bool = False) -> None:
+        """
+        Сжимает данные и пишет результат в файл. Выполняется в потоке
+        """
+        output = self.compressor.compress(data)
+        if flush_block:
+            output += self.compressor.flush(self._block_flush_mode())
+        if output:
+            self.file.write(output)
+        if sync:
+            self.file.flush()
+
+    async def __aenter__(self) -> "CompressedWriter":
+        self.compressor = self._make_compressor()
+        self.file = await asyncio.to_thread(open, self.path, self.mode + "b")
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _drain(self, sync: bool = False) -> None:
+        async with self.lock:
+            data = b"".join(self.buffer)
+            self.buffer.clear()
+            self.buffered = 0
+            self.since_block += len(data)
+            flush_block = sync or self.since_block >= self.block_size
+            if flush_block:
+                self.since_block = 0
+            await asyncio.to_thread(self._compress, data, flush_block, sync)
+
+    async def write(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            await self._drain()
+
+    async def flush(self) -> None:
+        """
+        Передаёт накопленный текст компрессору. Блок на диск сбрасывается
+        только по достижении block_size, чтобы не портить степень сжатия
+        """
+        if self.buffer:
+            await self._drain()
+
+    async def sync(self) -> None:
+        """
+        Закрывает текущий сжатый блок и передаёт всё записанное ОС, так что
+        оно переживёт падение процесса. Частые вызовы ухудшают сжатие
+        """
+        await self._drain(sync=True)
+
+    async def close(self) -> None:
+        await self._drain()
+        async with self.lock:
+            tail = self.compressor.flush()
+            await asyncio.to_thread(self.file.write, tail)
+            await asyncio.to_thread(self.file.close)
+
+
+def open_sink(
+    path: str,
+    mode: str = "w",
+    codec: str = "none",
+    block_size: int = BLOCK_SIZE,
+):
+    """
+    Открывает файл результатов: обычный текстовый через aiofiles
+    или сжатый через CompressedWriter
+    """
+    if codec == "none":
+        return aiofiles.open(path, mode, encoding="utf-8")
+    return CompressedWriter(path, codec, mode, block_size=block_size)
+
+
+async def sync_sink(file) -> None:
+    """
+    Передаёт ОС всё, что уже записано в файл результатов. Нужна там,
+    где кто-то полагается на наличие данных в файле, например индекс
+    обработанных url
+    """
+    if isinstance(file, CompressedWriter):
+        await file.sync()
+    else:
+        await file.flush()
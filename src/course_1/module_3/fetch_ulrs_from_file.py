@@ -1,121 +1,470 @@
 import asyncio
+import codecs
+import hashlib
 import json
-import threading
-from asyncio import CancelledError, Queue, TimeoutError
+import sqlite3
+from asyncio import TimeoutError
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
+from time import perf_counter
 
 import aiofiles
-from aiohttp import ClientConnectorDNSError, ClientSession, ClientTimeout, TCPConnector
+from adaptive_limiter import AdaptiveLimiter
+from aiohttp import (
+    ClientError,
+    ClientResponse,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+)
 from aiologic import Lock
+from compressed_sink import open_sink, sync_sink
+from fetch_urls import wait_first_error
+from host_scheduler import DNS_CACHE_TTL, KEEPALIVE_TIMEOUT, HostScheduler
+from json_validator import JsonValidator
+from metrics import REPORT_INTERVAL, FetchMetrics
 
 URLS_FILE = "urls.txt"
 RESULT_FILE = "results.jsonl"
+INDEX_FILE = "completed.sqlite3"
+CACHE_FILE = "http_cache.sqlite3"
+COMMIT_EVERY = 1000
 QUEUE_MAXSIZE = 100
 TIMEOUT = 60
 LIMIT = 5
+CHUNK_SIZE = 64 * 1024
+SPILL_THRESHOLD = 1024 * 1024
+LINE_BREAKS = bytes.maketrans(b"\r\n", b"  ")
 
 
-async def merge_file(tmp_files: dict[str, str], result_file: str):
+class SqliteStore:
     """
-    Перебирает временные файлы и записывает данные из них
-    в файл с общими результатами
+    Соединение с sqlite, запросы к которому выполняются в отдельном
+    потоке по одному, чтобы не останавливать цикл событий
     """
-    async with aiofiles.open(result_file, "a") as result:
-        for url, tmp_file_path in tmp_files.items():
-            async with aiofiles.open(tmp_file_path, "r", encoding="utf-8") as file:
-                try:
-                    await result.write(
-                        json.dumps(
-                            {
-                                "url": url,
-                                "content": json.loads(await file.read()),
-                            }
-                        )
-                        + "\n"
-                    )
-                except JSONDecodeError as exc:
-                    print(f"File {tmp_file_path} has a trouble: {exc}")
+
+    def __init__(self, path: str, schema: str, commit_every: int = COMMIT_EVERY):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(schema)
+        self.commit_every = commit_every
+        self.pending = 0
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    def _close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+    async def close(self) -> None:
+        await self.run(self._close)
+        self.executor.shutdown()
+
+
+class CompletedIndex(SqliteStore):
+    """
+    Индекс обработанных url в sqlite. Хранит только sha1 от url,
+    поэтому выдерживает десятки миллионов записей и не требует
+    загружать их в память
+    """
+
+    def __init__(self, path: str, commit_every: int = COMMIT_EVERY):
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS completed "
+            "(hash BLOB PRIMARY KEY) WITHOUT ROWID",
+            commit_every,
+        )
+
+    @staticmethod
+    def key(url: str) -> bytes:
+        return hashlib.sha1(url.encode()).digest()
+
+    def _contains(self, url: str) -> bool:
+        cursor = self.connection.execute(
+            "SELECT 1 FROM completed WHERE hash = ?", (self.key(url),)
+        )
+        return cursor.fetchone() is not None
+
+    async def contains(self, url: str) -> bool:
+        return await self.run(self._contains, url)
+
+    def _add(self, url: str) -> bool:
+        self.connection.execute(
+            "INSERT OR IGNORE INTO completed (hash) VALUES (?)", (self.key(url),)
+        )
+        self.pending += 1
+        if self.pending < self.commit_every:
+            return False
+        self.pending = 0
+        return True
+
+    async def add(self, url: str) -> bool:
+        """
+        Отмечает url обработанным. Изменения фиксируются пачками, поэтому
+        при падении последние url могут быть загружены повторно. Возвращает
+        True, когда набралось commit_every url: тогда вызывающий код должен
+        сбросить результаты на диск и вызвать commit, иначе в индексе
+        окажутся url, результатов которых в файле ещё нет
+        """
+        return await self.run(self._add, url)
+
+    async def commit(self) -> None:
+        await self.run(self.connection.commit)
+
+
+class ValidationCache(SqliteStore):
+    """
+    Кэш ответов в sqlite с валидаторами ETag и Last-Modified.
+    Позволяет делать условные запросы и брать тело из кэша при 304
+    """
+
+    def __init__(self, path: str, commit_every: int = COMMIT_EVERY):
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB)",
+            commit_every,
+        )
+
+    def _headers(self, url: str) -> dict[str, str]:
+        row = self.connection.execute(
+            "SELECT etag, last_modified FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return {}
+        etag, last_modified = row
+        headers = {}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    async def headers(self, url: str) -> dict[str, str]:
+        """
+        Возвращает заголовки условного запроса для url
+        """
+        return await self.run(self._headers, url)
+
+    def _body(self, url: str) -> bytes | None:
+        row = self.connection.execute(
+            "SELECT body FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    async def body(self, url: str) -> bytes | None:
+        return await self.run(self._body, url)
+
+    def _store(
+        self,
+        url: str,
+        etag: str | None,
+        last_modified: str | None,
+        body: bytes,
+    ) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+            (url, etag, last_modified, body),
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.connection.commit()
+            self.pending = 0
+
+    async def store(
+        self,
+        url: str,
+        etag: str | None,
+        last_modified: str | None,
+        body: bytes,
+    ) -> None:
+        """
+        Сохраняет тело ответа в том виде, в каком его отдал сервер
+        """
+        if etag is None and last_modified is None:
+            return
+        await self.run(self._store, url, etag, last_modified, body)
 
 
-def merge_files(
-    tmp_files: dict[str, str],
-    result_file: str,
+async def read_head(response: ClientResponse) -> tuple[bytes, bool]:
+    """
+    Читает тело ответа в память, пока оно не больше SPILL_THRESHOLD.
+    Возвращает прочитанное и признак того, что тело прочитано целиком
+    """
+    content_length = response.content_length
+    if content_length is not None and content_length > SPILL_THRESHOLD:
+        return b"", False
+
+    buffer = bytearray()
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        buffer += chunk
+        if len(buffer) > SPILL_THRESHOLD:
+            return bytes(buffer), False
+    return bytes(buffer), True
+
+
+async def write_spilled(
+    url: str,
+    response: ClientResponse,
+    head: bytes,
+    result_file,
+    file_lock: Lock,
+    stats: Counter,
 ) -> None:
     """
-        Добавляет содержимое временных файлов в
-        файл с итоговым результатом.
-    r"""
+    Дописывает тело ответа во временный файл, а затем копирует его
+    в файл результатов частями по CHUNK_SIZE, не собирая в памяти.
+    Тело проверяется JsonValidator по мере загрузки, и невалидный JSON
+    поднимает JSONDecodeError до записи, как json.loads для малых тел.
+    В JSON перевод строки может стоять только между токенами, поэтому
+    он заменяется пробелом, и запись остаётся одной строкой.
+    Временный файл удаляется при закрытии
+    """
+    validator = JsonValidator()
+    async with aiofiles.tempfile.TemporaryFile("wb+") as tmp_file:
+        validator.feed(head)
+        await tmp_file.write(head)
+        stats["spilled_bytes"] += len(head)
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            validator.feed(chunk)
+            await tmp_file.write(chunk)
+            stats["spilled_bytes"] += len(chunk)
+        validator.close()
+        await tmp_file.seek(0)
 
-    print("Current thread:", threading.current_thread().name)
-    asyncio.run(merge_file(tmp_files, result_file))
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        prefix = json.dumps({"url": url})[:-1] + ', "content": '
+        # Файл результатов занят только на время копирования с локального
+        # диска, а не на время загрузки из сети
+        async with file_lock:
+            await result_file.write(prefix)
+            written = len(prefix)
+            while chunk := await tmp_file.read(CHUNK_SIZE):
+                await result_file.write(decoder.decode(chunk.translate(LINE_BREAKS)))
+                written += len(chunk)
+            tail = decoder.decode(b"", final=True) + "}\n"
+            await result_file.write(tail)
+        stats["result_bytes"] += written + len(tail)
+
+
+async def write_line(record: dict, result_file, file_lock: Lock, stats: Counter):
+    line = json.dumps(record) + "\n"
+    async with file_lock:
+        await result_file.write(line)
+    stats["result_bytes"] += len(line)
 
 
 async def handler(
     session: ClientSession,
-    queue: Queue,
+    scheduler: HostScheduler,
+    result_file,
     file_lock: Lock,
+    stats: Counter,
+    index: CompletedIndex | None = None,
+    cache: ValidationCache | None = None,
+    metrics: FetchMetrics | None = None,
+    limiter: AdaptiveLimiter | None = None,
 ):
-    tmp_files = {}
     while True:
-        try:
-            url = await queue.get()
-        except CancelledError:
-            # Если на первом await поймали CancelledError,
-            # то мерджим готовые файлы этого воркера
-            # в общий результат
-            if tmp_files:
-                async with file_lock:
-                    await asyncio.to_thread(
-                        merge_files,
-                        tmp_files,
-                        RESULT_FILE,
-                    )
+        url = await scheduler.get()
+        if url is None:
             break
 
+        status = 0
+        if limiter is not None:
+            await limiter.acquire()
+        started = metrics.start() if metrics is not None else perf_counter()
         try:
-            async with session.get(url) as response:
-                async with aiofiles.tempfile.NamedTemporaryFile(
-                    "wb+",
-                    delete=False,
-                ) as tmp_file:
-                    if response.status == 200:
-                        async for chunk in response.content.iter_chunked(1024):
-                            await tmp_file.write(chunk)
-                        else:
-                            await tmp_file.flush()
-                            tmp_files[url] = str(tmp_file.name)
-        except (ClientConnectorDNSError, TimeoutError) as exc:
-            print(exc)
+            headers = await cache.headers(url) if cache is not None else {}
+            async with session.get(url, headers=headers) as response:
+                status = response.status
+                content = None
+                if response.status == 304 and cache is not None:
+                    body = await cache.body(url)
+                    if body is not None:
+                        content = json.loads(body)
+                        stats["cache_hits"] += 1
+                        stats["bytes_saved"] += len(body)
+                elif response.status == 200:
+                    body, complete = await read_head(response)
+                    if complete:
+                        content = json.loads(body)
+                    else:
+                        # Большое тело не кэшируется: его пришлось бы
+                        # целиком держать в памяти
+                        await write_spilled(
+                            url, response, body, result_file, file_lock, stats
+                        )
+                    if cache is not None:
+                        stats["cache_misses"] += 1
+                        if content is not None:
+                            await cache.store(
+                                url,
+                                response.headers.get("ETag"),
+                                response.headers.get("Last-Modified"),
+                                body,
+                            )
+                if content is not None:
+                    await write_line(
+                        {"url": url, "content": content}, result_file, file_lock, stats
+                    )
+            # Url отмечается только после записи результата, а индекс
+            # фиксируется только после сброса файла результатов на диск под
+            # той же блокировкой. Поэтому при падении url может попасть
+            # в файл дважды, но не потеряется
+            if index is not None and await index.add(url):
+                async with file_lock:
+                    await sync_sink(result_file)
+                    await index.commit()
+        except JSONDecodeError as exc:
+            print(f"Url {url} has a trouble: {exc}")
+        except (ClientError, TimeoutError) as exc:
+            # Сетевая ошибка одного url записывается в результаты и не
+            # останавливает загрузку. В индекс url не попадает, поэтому
+            # при следующем запуске он будет запрошен снова
+            status = 0
+            stats["errors"] += 1
+            error = f"{exc.__class__.__name__} {exc}".strip()
+            await write_line(
+                {"url": url, "status_code": 0, "error": error},
+                result_file,
+                file_lock,
+                stats,
+            )
         finally:
-            queue.task_done()
+            if metrics is not None:
+                metrics.finish(started, status)
+            if limiter is not None:
+                await limiter.release(perf_counter() - started, status)
+            await scheduler.done(url)
+
+
+async def fetch_urls(
+    urls_path: str,
+    result_path: str = RESULT_FILE,
+    index_path: str | None = None,
+    scheduler: HostScheduler | None = None,
+    cache_path: str | None = None,
+    codec: str = "none",
+    metrics: FetchMetrics | None = None,
+    report_interval: float | None = None,
+    limiter: AdaptiveLimiter | None = None,
+) -> Counter:
+    """
+    Загружает url из файла и дописывает ответы в result_path по мере
+    получения. Возвращает счётчики записанных на диск байт.
+
+    Если задан index_path, обработанные url сохраняются в индекс,
+    и при повторном запуске уже обработанные url пропускаются.
+
+    Url раздаются воркерам через HostScheduler, его статистику
+    по хостам можно получить, передав свой scheduler.
 
+    Если задан cache_path, ответы с ETag или Last-Modified сохраняются
+    в кэш, а при следующих запусках запрашиваются условно, и при 304
+    тело берётся из кэша.
 
-async def fetch_urls(urls_path: str) -> None:
-    queue: Queue[str] = Queue(maxsize=QUEUE_MAXSIZE)
+    codec задаёт сжатие файла результатов: none, gzip или zstd.
+
+    Если передан metrics, в него пишутся счётчики запросов, а в конце
+    печатается итоговый снимок. report_interval включает периодический
+    вывод снимков во время работы.
+
+    Если передан limiter, число одновременных запросов подбирается им
+    в пределах от limiter.min_limit до limiter.max_limit вместо LIMIT
+    """
+    workers_count = limiter.max_limit if limiter is not None else LIMIT
+    scheduler = scheduler or HostScheduler(per_host_queue=QUEUE_MAXSIZE)
     lock: Lock = Lock()
+    stats: Counter = Counter()
+    index = CompletedIndex(index_path) if index_path is not None else None
+    cache = ValidationCache(cache_path) if cache_path is not None else None
 
     timeout: ClientTimeout = ClientTimeout(total=TIMEOUT)
-    connector: TCPConnector = TCPConnector(limit=LIMIT)
+    connector: TCPConnector = TCPConnector(
+        limit=workers_count,
+        limit_per_host=scheduler.per_host_limit,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
 
-    async with ClientSession(connector=connector, timeout=timeout) as session:
-        workers = [
-            asyncio.create_task(
-                handler(session, queue, lock),
-            )
-            for _ in range(LIMIT)
-        ]
+    try:
+        async with (
+            ClientSession(connector=connector, timeout=timeout) as session,
+            open_sink(result_path, "a", codec) as result_file,
+        ):
+            workers = [
+                asyncio.create_task(
+                    handler(
+                        session,
+                        scheduler,
+                        result_file,
+                        lock,
+                        stats,
+                        index,
+                        cache,
+                        metrics,
+                        limiter,
+                    ),
+                )
+                for _ in range(workers_count)
+            ]
+            reporter_task = None
+            if metrics is not None:
+                metrics.queue_size = metrics.queue_size or scheduler.qsize
+                if report_interval is not None:
+                    reporter_task = asyncio.create_task(
+                        metrics.reporter(report_interval)
+                    )
 
-        async with aiofiles.open(urls_path, "r", encoding="utf-8") as urls_file:
-            async for line in urls_file:
-                url = line.strip()
-                await queue.put(url)
+            async def feed() -> None:
+                async with aiofiles.open(urls_path, "r", encoding="utf-8") as file:
+                    async for line in file:
+                        url = line.strip()
+                        if not url:
+                            continue
+                        if index is not None and await index.contains(url):
+                            stats["skipped_urls"] += 1
+                            continue
+                        await scheduler.put(url)
+                await scheduler.close()
 
-        await queue.join()
+            producer = asyncio.create_task(feed())
+            try:
+                await wait_first_error([producer, *workers])
+            finally:
+                producer.cancel()
+                for worker in workers:
+                    worker.cancel()
+                if reporter_task is not None:
+                    reporter_task.cancel()
+    finally:
+        if index is not None:
+            await index.close()
+        if cache is not None:
+            await cache.close()
+        if metrics is not None:
+            print(json.dumps(metrics.snapshot()))
 
-        for worker in workers:
-            worker.cancel()
-        await asyncio.gather(*workers)
+    return stats
 
 
 if __name__ == "__main__":
-    asyncio.run(fetch_urls(URLS_FILE))
+    print(
+        asyncio.run(
+            fetch_urls(
+                URLS_FILE,
+                index_path=INDEX_FILE,
+                cache_path=CACHE_FILE,
+                metrics=FetchMetrics(),
+                report_interval=REPORT_INTERVAL,
+            )
+        )
+    )
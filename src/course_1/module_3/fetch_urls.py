@@ -1,10 +1,15 @@
 import asyncio
 import json
-from asyncio import Lock, Semaphore, TimeoutError
+from asyncio import Queue, QueueEmpty, TimeoutError
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from time import perf_counter
 
 import aiofiles
-from aiohttp import ClientSession, ClientTimeout
-from aiohttp.client_exceptions import ClientConnectorDNSError
+from adaptive_limiter import AdaptiveLimiter
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from compressed_sink import open_sink
+from host_scheduler import DNS_CACHE_TTL, KEEPALIVE_TIMEOUT, HostScheduler
+from metrics import FetchMetrics
 
 urls = [
     "https://example.com",
@@ -15,62 +20,280 @@ urls = [
     "https://nonexistent.url",
 ]
 
+QUEUE_MAXSIZE = 1000
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+
+
+async def writer(
+    results: Queue,
+    file,
+    batch_size: int = BATCH_SIZE,
+    flush_interval: float = FLUSH_INTERVAL,
+) -> None:
+    """
+    Забирает результаты из очереди и пишет их в файл пачками.
+    Пачка сбрасывается, когда набралось batch_size строк или прошло
+    flush_interval секунд. None в очереди означает конец работы
+    """
+    loop = asyncio.get_running_loop()
+    done = False
+    while not done:
+        result = await results.get()
+        if result is None:
+            break
+        lines = [json.dumps(result) + "\n"]
+        deadline = loop.time() + flush_interval
+        while len(lines) < batch_size:
+            try:
+                result = results.get_nowait()
+            except QueueEmpty:
+                try:
+                    result = await asyncio.wait_for(
+                        results.get(),
+                        timeout=max(deadline - loop.time(), 0),
+                    )
+                except TimeoutError:
+                    break
+            if result is None:
+                done = True
+                break
+            lines.append(json.dumps(result) + "\n")
+        await file.write("".join(lines))
+        await file.flush()
+
 
 async def fetch_and_write(
     url: str,
     session: ClientSession,
-    semaphore: Semaphore,
-    file,
-    file_lock: Lock,
+    results: Queue,
     timeout: ClientTimeout = ClientTimeout(5),
+    metrics: FetchMetrics | None = None,
+    limiter: AdaptiveLimiter | None = None,
 ) -> None:
     """
-    Выполняет запрос и пишет линию с файл
+    Выполняет запрос и отправляет результат в очередь записи.
+    Если запись не успевает, очередь заполняется и запросы ждут
     """
     error = None
-    async with semaphore:
+    status = 0
+    if limiter is not None:
+        await limiter.acquire()
+    started = metrics.start() if metrics is not None else perf_counter()
+    try:
+        async with session.get(url, timeout=timeout) as response:
+            status = response.status
+    except (ClientError, TimeoutError) as exc:
+        # Любая сетевая ошибка - результат этого url, а не повод
+        # останавливать всю загрузку
+        status = 0
+        error = (f"{exc.__class__.__name__} {exc}").strip()
+    finally:
+        if metrics is not None:
+            metrics.finish(started, status)
+        if limiter is not None:
+            await limiter.release(perf_counter() - started, status)
+
+    result = {
+        "url": url,
+        "status_code": status,
+    }
+
+    if error is not None:
+        result["error"] = error
+
+    await results.put(result)
+
+
+async def read_urls(file_path: str) -> AsyncIterator[str]:
+    """
+    Построчно читает url из файла, пропуская пустые строки
+    """
+    async with aiofiles.open(file_path, "r", encoding="utf-8") as file:
+        async for line in file:
+            url = line.strip()
+            if url:
+                yield url
+
+
+async def fetch_worker(
+    scheduler: HostScheduler,
+    session: ClientSession,
+    results: Queue,
+    timeout: ClientTimeout,
+    metrics: FetchMetrics | None = None,
+    limiter: AdaptiveLimiter | None = None,
+) -> None:
+    """
+    Забирает url из планировщика, пока он не вернёт None
+    """
+    while True:
+        url = await scheduler.get()
+        if url is None:
+            break
         try:
-            async with session.get(url, timeout=timeout) as response:
-                status = response.status
-        except (ClientConnectorDNSError, TimeoutError) as exc:
-            status = 0
-            error = (f"{exc.__class__.__name__} {exc}").strip()
+            await fetch_and_write(
+                url,
+                session,
+                results,
+                timeout,
+                metrics,
+                limiter,
+            )
+        finally:
+            await scheduler.done(url)
 
-        result = {
-            "url": url,
-            "status_code": status,
-        }
 
-        if error is not None:
-            result["error"] = error
+async def feed(
+    urls: Iterable[str] | AsyncIterable[str],
+    scheduler: HostScheduler,
+) -> None:
+    """
+    Передаёт url планировщику и закрывает его
+    """
+    if isinstance(urls, AsyncIterable):
+        async for url in urls:
+            await scheduler.put(url)
+    else:
+        for url in urls:
+            await scheduler.put(url)
+    await scheduler.close()
 
-        async with file_lock:
-            await file.write(json.dumps(result) + "\n")
 
+async def wait_first_error(
+    tasks: list[asyncio.Task],
+    watched: Iterable[asyncio.Task] = (),
+) -> None:
+    """
+    Ждёт завершения всех задач tasks. Если одна из них или одна из задач
+    watched упала, сразу поднимает её исключение: иначе остальные навсегда
+    повиснут на put в очередь, которую уже никто не разбирает. Завершения
+    задач watched не ждёт, например писателя, который закончит работу
+    только после tasks
+    """
+    pending = set(tasks)
+    watched = set(watched)
+    while pending:
+        done, _ = await asyncio.wait(
+            pending | watched, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            task.result()
+        pending -= done
+        watched -= done
 
-async def fetch_urls(urls: list[str], file_path: str, limit: int = 5) -> None:
+
+async def stop_writer(results: Queue, writer_task: asyncio.Task) -> None:
+    """
+    Отправляет писателю None и ждёт, пока он допишет очередь. Если писатель
+    упал, очередь никто не разбирает, поэтому put ждётся вместе с ним
     """
-    Задаёт ограничения и создаёт таски
+    sentinel = asyncio.create_task(results.put(None))
+    try:
+        await asyncio.wait([sentinel, writer_task], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if not sentinel.done():
+            sentinel.cancel()
+    await writer_task
+
+
+async def fetch_urls_stream(
+    urls: Iterable[str] | AsyncIterable[str],
+    file_path: str,
+    limit: int = 5,
+    scheduler: HostScheduler | None = None,
+    codec: str = "none",
+    metrics: FetchMetrics | None = None,
+    report_interval: float | None = None,
+    limiter: AdaptiveLimiter | None = None,
+) -> None:
     """
-    semaphore = Semaphore(limit)
-    file_lock = Lock()
+    Обрабатывает url из любого итерируемого источника фиксированным
+    пулом из limit воркеров. Очереди ограничены, поэтому память
+    зависит только от limit, а не от числа url.
+
+    Url раздаются воркерам через HostScheduler, который ограничивает
+    число одновременных запросов к одному хосту. Его статистику по хостам
+    можно получить, передав свой scheduler.
+
+    codec задаёт сжатие файла результатов: none, gzip или zstd.
+
+    Если передан metrics, в него пишутся счётчики запросов, а в конце
+    печатается итоговый снимок. report_interval включает периодический
+    вывод снимков во время работы.
+
+    Если передан limiter, число одновременных запросов подбирается им
+    в пределах от limiter.min_limit до limiter.max_limit, а limit
+    не используется
+    """
+    if limiter is not None:
+        limit = limiter.max_limit
+    scheduler = scheduler or HostScheduler()
+    results: Queue = Queue(maxsize=QUEUE_MAXSIZE)
     timeout = ClientTimeout(5)
+    connector = TCPConnector(
+        limit=limit,
+        limit_per_host=scheduler.per_host_limit,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
 
-    async with ClientSession() as session:
-        async with aiofiles.open(file_path, "w", encoding="utf-8") as file:
-            tasks = [
-                fetch_and_write(
-                    url,
-                    session,
-                    semaphore,
-                    file,
-                    file_lock,
-                    timeout,
+    async with ClientSession(connector=connector) as session:
+        async with open_sink(file_path, "w", codec) as file:
+            writer_task = asyncio.create_task(writer(results, file))
+            workers = [
+                asyncio.create_task(
+                    fetch_worker(
+                        scheduler,
+                        session,
+                        results,
+                        timeout,
+                        metrics,
+                        limiter,
+                    ),
                 )
-                for url in urls
+                for _ in range(limit)
             ]
-            await asyncio.gather(*tasks)
+            reporter_task = None
+            if metrics is not None:
+                metrics.queue_size = metrics.queue_size or scheduler.qsize
+                if report_interval is not None:
+                    reporter_task = asyncio.create_task(
+                        metrics.reporter(report_interval)
+                    )
+            producer = asyncio.create_task(feed(urls, scheduler))
+            try:
+                await wait_first_error([producer, *workers], [writer_task])
+            finally:
+                producer.cancel()
+                for worker in workers:
+                    worker.cancel()
+                if reporter_task is not None:
+                    reporter_task.cancel()
+                await stop_writer(results, writer_task)
+                if metrics is not None:
+                    print(json.dumps(metrics.snapshot()))
+
+
+async def fetch_urls(urls: list[str], file_path: str, limit: int = 5) -> None:
+    """
+    Обрабатывает список url, см. fetch_urls_stream. Все limit запросов
+    могут идти к одному хосту, как и до появления HostScheduler
+    """
+    await fetch_urls_stream(
+        urls,
+        file_path,
+        limit,
+        HostScheduler(per_host_limit=limit),
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(fetch_urls(urls, "./results.jsonl"))
+    asyncio.run(
+        fetch_urls_stream(
+            urls,
+            "./results.jsonl",
+            metrics=FetchMetrics(),
+            report_interval=1.0,
+        )
+    )
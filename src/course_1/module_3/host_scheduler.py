@@ -0,0 +1,195 @@
+import asyncio
+from collections import deque
+from time import perf_counter
+from urllib.parse import urlsplit
+
+PER_HOST_LIMIT = 2
+PER_HOST_QUEUE = 100
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+MAX_QUEUED = 1000
+MAX_TRACKED_HOSTS = 1000
+OTHER_HOSTS = "*"
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.first_start: float | None = None
+        self.last_done: float | None = None
+
+    @property
+    def throughput(self) -> float:
+        """
+        Запросов в секунду за время, пока хост был в работе
+        """
+        if self.first_start is None or self.last_done is None:
+            return 0.0
+        elapsed = self.last_done - self.first_start
+        return self.requests / elapsed if elapsed > 0 else 0.0
+
+
+class HostScheduler:
+    """
+    Раздаёт url воркерам по кругу между хостами. На каждый хост
+    одновременно выдаётся не больше per_host_limit url, очередь хоста
+    ограничена per_host_queue url, а все очереди вместе - max_queued,
+    поэтому медленный хост не занимает все слоты, а память не растёт
+    даже на списке из миллионов разных хостов.
+
+    Хосты, у которых есть url и свободный слот, лежат в очереди ready,
+    поэтому выдача url стоит O(1), а не O(числа хостов). Получатели
+    и отправители ждут на разных условиях и будятся по одному.
+    Статистика хранится не больше чем для max_tracked_hosts хостов,
+    остальные суммируются в запись OTHER_HOSTS
+    """
+
+    def __init__(
+        self,
+        per_host_limit: int = PER_HOST_LIMIT,
+        per_host_queue: int = PER_HOST_QUEUE,
+        max_queued: int = MAX_QUEUED,
+        max_tracked_hosts: int = MAX_TRACKED_HOSTS,
+    ):
+        self.per_host_limit = per_host_limit
+        self.per_host_queue = per_host_queue
+        self.max_queued = max_queued
+        self.max_tracked_hosts = max_tracked_hosts
+        self.queues: dict[str, deque[str]] = {}
+        self.active: dict[str, int] = {}
+        self.ready: deque[str] = deque()
+        self.in_ready: set[str] = set()
+        self.stats: dict[str, HostStats] = {}
+        lock = asyncio.Lock()
+        self.not_empty = asyncio.Condition(lock)
+        self.not_full = asyncio.Condition(lock)
+        self.closed = False
+        self.size = 0
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlsplit(url).netloc
+
+    def _mark_ready(self, host: str) -> None:
+        """
+        Ставит хост в очередь ready, если у него есть url и свободный
+        слот, и будит одного получателя
+        """
+        if (
+            host not in self.in_ready
+            and self.queues.get(host)
+            and self.active.get(host, 0) < self.per_host_limit
+        ):
+            self.ready.append(host)
+            self.in_ready.add(host)
+            self.not_empty.notify()
+
+    async def put(self, url: str) -> None:
+        """
+        Ставит url в очередь его хоста, ожидая, если заполнена она
+        или общая очередь
+        """
+        host = self.host(url)
+        async with self.not_full:
+            await self.not_full.wait_for(
+                lambda: (
+                    self.size < self.max_queued
+                    and len(self.queues.get(host, ())) < self.per_host_queue
+                )
+            )
+            self.queues.setdefault(host, deque()).append(url)
+            self.size += 1
+            self._mark_ready(host)
+
+    def qsize(self) -> int:
+        """
+        Возвращает число url, ожидающих в очередях всех хостов
+        """
+        return self.size
+
+    async def close(self) -> None:
+        """
+        Сообщает, что новых url не будет
+        """
+        async with self.not_empty:
+            self.closed = True
+            self.not_empty.notify_all()
+
+    def _pick(self) -> str | None:
+        """
+        Берёт url у следующего готового хоста. Хост, у которого
+        остались url и слоты, уходит в конец очереди ready
+        """
+        if not self.ready:
+            return None
+        host = self.ready.popleft()
+        self.in_ready.discard(host)
+        self.active[host] = self.active.get(host, 0) + 1
+        self.size -= 1
+        url = self.queues[host].popleft()
+        self._mark_ready(host)
+        if self.closed and not self.size:
+            # Остальным получателям пора вернуть None
+            self.not_empty.notify_all()
+        # Отправителей обычно один-два, и ждут они разных хостов
+        self.not_full.notify_all()
+        return url
+
+    async def get(self) -> str | None:
+        """
+        Возвращает следующий url или None, когда очередь закрыта и пуста
+        """
+        async with self.not_empty:
+            while True:
+                url = self._pick()
+                if url is not None:
+                    stats = self.stats.get(self.host(url))
+                    if stats is None:
+                        stats = self.stats[self.host(url)] = HostStats()
+                    if stats.first_start is None:
+                        stats.first_start = perf_counter()
+                    return url
+                if self.closed and not self.size:
+                    return None
+                await self.not_empty.wait()
+
+    def _forget(self, host: str) -> None:
+        """
+        Удаляет хост без работы, чтобы память не росла с числом хостов.
+        Сверх max_tracked_hosts его статистика добавляется к OTHER_HOSTS
+        """
+        del self.active[host]
+        del self.queues[host]
+        if len(self.stats) <= self.max_tracked_hosts:
+            return
+        stats = self.stats.pop(host)
+        other = self.stats.setdefault(OTHER_HOSTS, HostStats())
+        other.requests += stats.requests
+        if other.first_start is None or stats.first_start < other.first_start:
+            other.first_start = stats.first_start
+        if other.last_done is None or stats.last_done > other.last_done:
+            other.last_done = stats.last_done
+
+    async def done(self, url: str) -> None:
+        """
+        Освобождает слот хоста после обработки url
+        """
+        host = self.host(url)
+        async with self.not_empty:
+            self.active[host] -= 1
+            stats = self.stats[host]
+            stats.requests += 1
+            stats.last_done = perf_counter()
+            if not self.active[host] and not self.queues[host]:
+                self._forget(host)
+            else:
+                self._mark_ready(host)
+
+    def report(self) -> list[tuple[str, int, float]]:
+        """
+        Возвращает (хост, число запросов, запросов в секунду)
+        """
+        return [
+            (host, stats.requests, stats.throughput)
+            for host, stats in sorted(self.stats.items())
+        ]
@@ -0,0 +1,139 @@
+import re
+from json import JSONDecodeError
+
+# Строки и скаляры заменяются байтами, которые недопустимы в JSON
+# ни внутри строк, ни снаружи, поэтому их нельзя спутать с исходными
+STRING_MARK = b"\x00"
+SCALAR_MARK = b"\x01"
+STRING_CHARS = (
+    rb'[^"\\\x00-\x1f]*+(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*+)*+'
+)
+STRING = re.compile(rb'"' + STRING_CHARS + rb'"')
+STRING_BODY = re.compile(STRING_CHARS)
+SCALAR = re.compile(
+    rb"-?(?:0|[1-9][0-9]*+)(?:\.[0-9]++)?+(?:[eE][+-]?[0-9]++)?+|true|false|null"
+)
+WHITESPACE = b" \t\n\r"
+# Хвост части, который может оказаться началом числа или литерала
+TRAILING_SCALAR = re.compile(rb"[-+.0-9a-zA-Z]+\Z")
+# Самый длинный хвост строки, который может оказаться началом \uXXXX
+MAX_ESCAPE = 6
+
+VALUE, FIRST_ITEM, FIRST_KEY, KEY, COLON, AFTER, DONE = range(7)
+VALUE_STATES = (VALUE, FIRST_ITEM)
+OPEN_OBJECT, CLOSE_OBJECT, OPEN_ARRAY, CLOSE_ARRAY, COMMA, SEMICOLON = b"{}[],:"
+STRING_SYMBOL, SCALAR_SYMBOL = STRING_MARK[0], SCALAR_MARK[0]
+
+
+class JsonValidator:
+    """
+    Проверяет JSON-документ по частям, не собирая его в памяти.
+    Части подаются в feed по мере загрузки, close проверяет, что документ
+    закончился. При ошибке поднимается JSONDecodeError, как у json.loads,
+    с позицией начала части, в которой найдена ошибка.
+    Строки, числа, литералы и пробелы сворачиваются регулярными
+    выражениями, и цикл на Python проверяет только структуру
+    """
+
+    def __init__(self):
+        self.stack = bytearray()
+        self.state = VALUE
+        self.in_string = False
+        self.tail = b""
+        self.offset = 0
+
+    def error(self, message: str) -> JSONDecodeError:
+        return JSONDecodeError(message, "", self.offset)
+
+    def feed(self, chunk: bytes, final: bool = False) -> None:
+        data = self.tail + chunk
+        self.tail = b""
+        if STRING_MARK in data or SCALAR_MARK in data:
+            raise self.error("Invalid control character")
+        if self.in_string:
+            data = self.skip_string(data, final)
+        if data:
+            self.walk(self.reduce(data, final))
+        self.offset += len(chunk)
+
+    def skip_string(self, data: bytes, final: bool) -> bytes:
+        """
+        Пропускает продолжение строки, начатой в прошлых частях.
+        Возвращает данные после закрывающей кавычки
+        """
+        pos = STRING_BODY.match(data).end()
+        if pos < len(data) and data[pos] == ord('"'):
+            self.in_string = False
+            self.walk(STRING_MARK)
+            return data[pos + 1 :]
+        rest = len(data) - pos
+        if final or (rest and (data[pos] != ord("\\") or rest >= MAX_ESCAPE)):
+            raise self.error("Invalid string")
+        self.tail = data[pos:]
+        return b""
+
+    def reduce(self, data: bytes, final: bool) -> bytes:
+        reduced = STRING.sub(STRING_MARK, data)
+        # Незакрытой может быть только последняя строка: после её кавычки
+        # замен не было, и остаток совпадает с исходными данными
+        quote = reduced.find(b'"')
+        if quote != -1:
+            start = len(data) - len(reduced) + quote
+            if reduced[quote:] != data[start:]:
+                raise self.error("Invalid string")
+            self.in_string = True
+            self.skip_string(data[start + 1 :], final)
+            reduced = reduced[:quote]
+        elif not final:
+            match = TRAILING_SCALAR.search(reduced)
+            if match is not None:
+                self.tail = match.group()
+                reduced = reduced[: match.start()]
+        # Пробелы удаляются после замены скаляров, чтобы "1 2" не стало "12"
+        return SCALAR.sub(SCALAR_MARK, reduced).translate(None, WHITESPACE)
+
+    def walk(self, symbols: bytes) -> None:
+        stack = self.stack
+        state = self.state
+        for symbol in symbols:
+            if symbol == SCALAR_SYMBOL:
+                if state not in VALUE_STATES:
+                    raise self.error("Unexpected value")
+                state = AFTER if stack else DONE
+            elif symbol == STRING_SYMBOL:
+                if state == FIRST_KEY or state == KEY:
+                    state = COLON
+                elif state in VALUE_STATES:
+                    state = AFTER if stack else DONE
+                else:
+                    raise self.error("Unexpected string")
+            elif symbol == COMMA:
+                if state != AFTER:
+                    raise self.error("Unexpected comma")
+                state = KEY if stack[-1] == OPEN_OBJECT else VALUE
+            elif symbol == SEMICOLON:
+                if state != COLON:
+                    raise self.error("Unexpected colon")
+                state = VALUE
+            elif symbol == OPEN_OBJECT or symbol == OPEN_ARRAY:
+                if state not in VALUE_STATES:
+                    raise self.error("Unexpected bracket")
+                stack.append(symbol)
+                state = FIRST_KEY if symbol == OPEN_OBJECT else FIRST_ITEM
+            elif symbol == CLOSE_OBJECT or symbol == CLOSE_ARRAY:
+                opening = OPEN_OBJECT if symbol == CLOSE_OBJECT else OPEN_ARRAY
+                first = FIRST_KEY if symbol == CLOSE_OBJECT else FIRST_ITEM
+                if not stack or stack[-1] != opening:
+                    raise self.error("Unbalanced bracket")
+                if state != AFTER and state != first:
+                    raise self.error("Unexpected bracket")
+                stack.pop()
+                state = AFTER if stack else DONE
+            else:
+                raise self.error("Expecting value")
+        self.state = state
+
+    def close(self) -> None:
+        self.feed(b"", final=True)
+        if self.state != DONE:
+            raise self.error("Unexpected end of document")
@@ -0,0 +1,111 @@
+import asyncio
+import json
+from collections import Counter
+from collections.abc import Callable
+from time import perf_counter
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+REPORT_INTERVAL = 5.0
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек в духе HDR Histogram: значения в микросекундах
+    раскладываются по корзинам, где на каждую степень двойки приходится
+    SUB_BUCKETS линейных корзин. Запись - O(1), относительная ошибка
+    перцентилей не больше 1 / SUB_BUCKETS
+    """
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.total = 0
+        self.max_us = 0
+
+    @staticmethod
+    def index(value_us: int) -> int:
+        if value_us < SUB_BUCKETS:
+            return value_us
+        shift = value_us.bit_length() - SUB_BUCKET_BITS - 1
+        return (shift + 1) * SUB_BUCKETS + (value_us >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def lower_bound(index: int) -> int:
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+    def record(self, seconds: float) -> None:
+        value_us = int(seconds * 1_000_000)
+        self.counts[self.index(value_us)] += 1
+        self.total += 1
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def percentile(self, q: float) -> float:
+        """
+        Возвращает q-й перцентиль (0-100) в секундах
+        """
+        if not self.total:
+            return 0.0
+        threshold = self.total * q / 100
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return self.lower_bound(index) / 1_000_000
+        return self.max_us / 1_000_000
+
+
+class FetchMetrics:
+    """
+    Счётчики загрузчика: запросы в полёте, ответы по статусам,
+    гистограмма задержек и размер очереди, если задан queue_size
+    """
+
+    def __init__(self, queue_size: Callable[[], int] | None = None):
+        self.started = perf_counter()
+        self.in_flight = 0
+        self.statuses: Counter = Counter()
+        self.latency = LatencyHistogram()
+        self.queue_size = queue_size
+
+    def start(self) -> float:
+        """
+        Отмечает начало запроса и возвращает момент старта
+        """
+        self.in_flight += 1
+        return perf_counter()
+
+    def finish(self, started: float, status: int) -> None:
+        """
+        Отмечает конец запроса. Статус 0 означает ошибку соединения
+        """
+        self.in_flight -= 1
+        self.statuses[status] += 1
+        self.latency.record(perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        elapsed = perf_counter() - self.started
+        completed = self.latency.total
+        return {
+            "elapsed": round(elapsed, 3),
+            "completed": completed,
+            "rps": round(completed / elapsed, 1) if elapsed > 0 else 0.0,
+            "in_flight": self.in_flight,
+            "queue_size": self.queue_size() if self.queue_size else None,
+            "statuses": dict(self.statuses),
+            "p50": self.latency.percentile(50),
+            "p95": self.latency.percentile(95),
+            "p99": self.latency.percentile(99),
+            "max": self.latency.max_us / 1_000_000,
+        }
+
+    async def reporter(self, interval: float = REPORT_INTERVAL) -> None:
+        """
+        Печатает снимок метрик каждые interval секунд, пока не отменён
+        """
+        while True:
+            await asyncio.sleep(interval)
+            print(json.dumps(self.snapshot()))
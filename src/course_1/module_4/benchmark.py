@@ -0,0 +1,163 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Callable
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Возвращает q-й перцентиль (0-100) с линейной интерполяцией
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def peak_rss_kb() -> int:
+    """
+    Возвращает в килобайтах пиковый RSS текущего процесса плюс пик самого
+    большого из его завершённых дочерних процессов. Значение только растёт
+    за время жизни процесса, поэтому замеры отдельных случаев нужно
+    запускать через isolated
+    """
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        # На macOS ru_maxrss в байтах, на Linux - в килобайтах
+        return (self_rss + children_rss) // 1024
+    return self_rss + children_rss
+
+
+def measure(
+    func: Callable,
+    *args,
+    repeat: int = 5,
+    warmup: int = 1,
+    **kwargs,
+) -> dict[str, Any]:
+    """
+    Прогревает функцию warmup раз, затем замеряет repeat запусков
+    и возвращает статистику по времени выполнения в секундах
+    """
+    for _ in range(warmup):
+        func(*args, **kwargs)
+
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func(*args, **kwargs)
+        timings.append(perf_counter() - start)
+
+    return {
+        "repeat": repeat,
+        "warmup": warmup,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "p95": percentile(timings, 95),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def isolated(func: Callable, *args, **kwargs) -> Any:
+    """
+    Выполняет func в новом процессе интерпретатора и возвращает результат.
+    Так peak_rss_kb внутри func видит память только этого вызова,
+    а не максимум всех предыдущих замеров. func и аргументы должны
+    сериализоваться pickle
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(func, *args, **kwargs).result()
+
+
+def git_commit() -> str | None:
+    """
+    Возвращает хэш текущего коммита или None вне git-репозитория
+    """
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def metadata() -> dict[str, Any]:
+    """
+    Собирает сведения о машине и коммите, на которых идёт замер
+    """
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_jsonl(records: list[dict], file_path: str) -> None:
+    """
+    Дописывает записи в файл, по одному JSON-объекту на строку
+    """
+    with open(file_path, "a", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_jsonl(file_path: str) -> list[dict]:
+    """
+    Читает записи из JSONL-файла
+    """
+    with open(file_path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def record_key(record: dict) -> tuple:
+    """
+    Возвращает ключ, по которому сопоставляются замеры из разных файлов
+    """
+    return (
+        record["name"],
+        record["strategy"],
+        record["size"],
+        record["workers"],
+    )
+
+
+def compare(
+    old_path: str,
+    new_path: str,
+    threshold: float = 0.1,
+) -> list[tuple]:
+    """
+    Сравнивает медианы замеров из двух файлов. Возвращает строки
+    (ключ, старая медиана, новая медиана, изменение, регрессия), где
+    регрессией считается замедление больше чем на threshold
+    """
+    # Если в файле несколько прогонов, берётся последний замер для ключа
+    old = {record_key(record): record for record in read_jsonl(old_path)}
+    new = {record_key(record): record for record in read_jsonl(new_path)}
+
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        old_median = old[key]["median"]
+        new_median = new[key]["median"]
+        change = new_median / old_median - 1
+        rows.append((key, old_median, new_median, change, change > threshold))
+    return rows
@@ -0,0 +1,206 @@
+import logging
+import math
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache
+from time import perf_counter
+from typing import NamedTuple
+
+from process_numbers import (
+    STRATEGIES,
+    auto_chunksize,
+    generate_data,
+    process_pool_processing,
+    sequence_processing,
+    thread_poo_processing,
+)
+
+SAMPLE_SIZE = 64
+LARGE_SAMPLE_SIZE = 4096
+# Большая выборка считается в текущем потоке, поэтому она не больше
+# этой доли входа, иначе на средних пачках калибровка и есть вся работа
+SAMPLE_SHARE = 16
+SAMPLE_REPEAT = 3
+IPC_SAMPLES = 16
+
+logger = logging.getLogger("dispatcher")
+
+
+class Calibration(NamedTuple):
+    fixed_cost: float
+    item_cost: float
+    transfer_cost: float
+    spawn_cost: float
+    message_cost: float
+    thread_cost: float
+
+
+class Plan(NamedTuple):
+    executor: str
+    workers: int
+    predicted: float
+
+
+def free_threaded() -> bool:
+    """
+    Проверяет, запущен ли интерпретатор без GIL (сборки 3.13t)
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+@cache
+def calibrate_executors() -> tuple[float, float, float]:
+    """
+    Замеряет запуск процесса, одно сообщение между процессами
+    и запуск потока. Результат кэшируется на время жизни процесса
+    """
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        executor.submit(int).result()
+        spawn_cost = perf_counter() - start
+        start = perf_counter()
+        for _ in range(IPC_SAMPLES):
+            executor.submit(int).result()
+        # Каждая задача - это два сообщения: запрос и ответ
+        message_cost = (perf_counter() - start) / IPC_SAMPLES / 2
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(int).result()
+    thread_cost = perf_counter() - start
+    return spawn_cost, message_cost, thread_cost
+
+
+def calibrate(numbers: list[int], strategy: str) -> tuple[Calibration, list[tuple]]:
+    """
+    Оценивает стоимость обработки пачки чисел как fixed_cost + n * item_cost
+    по двум выборкам разного размера. У пакетных стратегий решето и проход
+    по факториалам - это постоянная стоимость пачки, и на одной маленькой
+    выборке она выглядела бы как огромная стоимость числа. Возвращает
+    калибровку и результат большой выборки, чтобы не считать его повторно
+    """
+    process = STRATEGIES[strategy]
+    small = numbers[:SAMPLE_SIZE]
+    large_size = min(LARGE_SAMPLE_SIZE, len(numbers) // SAMPLE_SHARE)
+    large = numbers[: max(large_size, SAMPLE_SIZE * 2)]
+    small_time = math.inf
+    for _ in range(SAMPLE_REPEAT):
+        start = perf_counter()
+        process(small)
+        small_time = min(small_time, perf_counter() - start)
+    start = perf_counter()
+    sample_result = process(large)
+    large_time = perf_counter() - start
+
+    if len(large) > len(small):
+        item_cost = max((large_time - small_time) / (len(large) - len(small)), 0.0)
+        fixed_cost = max(small_time - item_cost * len(small), 0.0)
+    else:
+        item_cost = large_time / max(len(large), 1)
+        fixed_cost = 0.0
+    # Результаты возвращаются из процессов через pickle, и для больших
+    # факториалов это дороже самого счёта
+    start = perf_counter()
+    pickle.loads(pickle.dumps(sample_result, pickle.HIGHEST_PROTOCOL))
+    transfer_cost = (perf_counter() - start) / max(len(sample_result), 1)
+    return (
+        Calibration(fixed_cost, item_cost, transfer_cost, *calibrate_executors()),
+        sample_result,
+    )
+
+
+def plan(
+    count: int,
+    calibration: Calibration,
+    max_workers: int,
+    cpus: int | None = None,
+) -> Plan:
+    """
+    Выбирает исполнителя и число воркеров с наименьшим предсказанным временем.
+    Каждая пачка платит fixed_cost, поэтому дробление на пачки не бесплатно.
+    Параллельно работает не больше cpus воркеров, по умолчанию - число ядер
+    """
+    cpus = cpus or os.cpu_count() or 1
+    fixed, item = calibration.fixed_cost, calibration.item_cost
+    plans = [Plan("inline", 1, fixed + count * item)]
+    for workers in range(2, max_workers + 1):
+        # Потоки получают по одной пачке, с GIL они не ускоряют счёт,
+        # а только добавляют накладные расходы
+        thread_work = workers * fixed + count * item
+        if free_threaded():
+            thread_work /= min(workers, cpus)
+        plans.append(
+            Plan(
+                "thread",
+                workers,
+                thread_work + calibration.thread_cost * workers,
+            )
+        )
+        chunks = math.ceil(count / auto_chunksize(count, workers))
+        plans.append(
+            Plan(
+                "process",
+                workers,
+                (chunks * fixed + count * item) / min(workers, cpus)
+                + count * calibration.transfer_cost
+                + calibration.spawn_cost * workers
+                + calibration.message_cost * 2 * chunks,
+            )
+        )
+    # При равенстве оценок на free-threaded сборке предпочитаем потоки
+    order = {"inline": 0, "thread": 1, "process": 2}
+    return min(plans, key=lambda item: (item.predicted, order[item.executor]))
+
+
+def dispatch(
+    numbers: list[int],
+    strategy: str = "batch",
+    max_workers: int | None = None,
+) -> list[tuple]:
+    """
+    Обрабатывает числа исполнителем, выбранным по модели стоимости,
+    и логирует предсказанное и фактическое время, а также время калибровки,
+    которая тоже считает часть чисел в текущем потоке
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    start = perf_counter()
+    calibration, result = calibrate(numbers, strategy)
+    calibration_time = perf_counter() - start
+    # Начало списка уже посчитано при калибровке
+    rest = numbers[len(result) :]
+    chosen = plan(len(rest), calibration, max_workers)
+
+    start = perf_counter()
+    if not rest:
+        pass
+    elif chosen.executor == "inline":
+        result += sequence_processing(rest, strategy)
+    elif chosen.executor == "thread":
+        result += thread_poo_processing(rest, chosen.workers, strategy)
+    else:
+        result += process_pool_processing(rest, chosen.workers, strategy)
+    actual = perf_counter() - start
+
+    logger.info(
+        "strategy=%s count=%d sample=%d calibration=%.6f "
+        "executor=%s workers=%d predicted=%.6f actual=%.6f",
+        strategy,
+        len(rest),
+        len(numbers) - len(rest),
+        calibration_time,
+        chosen.executor,
+        chosen.workers,
+        chosen.predicted,
+        actual,
+    )
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(name)s %(message)s")
+    for size in (100, 5000, 50000):
+        for strategy in ("naive", "batch"):
+            dispatch(generate_data(size), strategy)
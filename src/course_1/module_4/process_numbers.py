@@ -1,32 +1,21 @@
-import json
+import argparse
+import math
 import os
+import sys
+from array import array
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-from functools import wraps
+from functools import partial
+from itertools import chain
 from multiprocessing import Process, Queue
 from random import randint
-from time import perf_counter
 
+from benchmark import compare, isolated, measure, metadata, write_jsonl
 from tabulate import tabulate
 
-
-def time_it(title: str):
-    """
-    Замеряет время выполнения функции и возвращает результат
-    измерения вместо результата работы функции
-    """
-
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            start = perf_counter()
-            result = func(*args, **kwargs)
-            end = perf_counter()
-            diff = end - start
-            return title, f"{diff:.6f}"
-
-        return wrapper
-
-    return decorator
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def generate_data(n: int, limit: int = 1000) -> list[int]:
@@ -59,6 +48,64 @@ def get_factorial(num: int) -> int:
     return result
 
 
+def sieve(limit: int):
+    """
+    Строит решето Эратосфена до limit включительно. Возвращает массив
+    numpy, если он установлен, иначе bytearray
+    """
+    if numpy is not None:
+        flags = numpy.ones(limit + 1, dtype=bool)
+        flags[:2] = False
+        for i in range(2, math.isqrt(limit) + 1):
+            if flags[i]:
+                flags[i * i :: i] = False
+        return flags
+
+    flags = bytearray([1]) * (limit + 1)
+    flags[:2] = bytes(2)
+    for i in range(2, math.isqrt(limit) + 1):
+        if flags[i]:
+            flags[i * i :: i] = bytes(len(range(i * i, limit + 1, i)))
+    return flags
+
+
+def is_prime_batch(numbers: list[int]) -> list[bool]:
+    """
+    Проверяет на простоту сразу все числа, построив одно решето до максимума
+    """
+    if not numbers:
+        return []
+    flags = sieve(max(max(numbers), 1))
+    if numpy is not None:
+        indexes = numpy.maximum(numpy.asarray(numbers), 0)
+        return flags[indexes].tolist()
+    return [num > 1 and bool(flags[num]) for num in numbers]
+
+
+def factorial_batch(
+    numbers: list[int],
+    modulo: int | None = None,
+    bit_length: bool = False,
+) -> list[int]:
+    """
+    Вычисляет факториалы сразу для всех чисел одним проходом: уникальные
+    числа сортируются, и каждый факториал получается из предыдущего.
+    Если задан modulo, возвращаются факториалы по модулю, если bit_length -
+    длина факториала в битах. Так огромные числа не гоняются между процессами
+    """
+    factorials = {}
+    result = 1
+    current = 1
+    for num in sorted(set(numbers)):
+        for i in range(current + 1, num + 1):
+            result *= i
+            if modulo is not None:
+                result %= modulo
+        current = max(current, num)
+        factorials[num] = result.bit_length() if bit_length else result
+    return [factorials[num] for num in numbers]
+
+
 def process_number(number: int) -> tuple:
     """
     Обрабатывает число
@@ -68,114 +115,351 @@ def process_number(number: int) -> tuple:
     return prime_check, factorial_result
 
 
-def worker(input_queue, output_queue, worker_id: int):
+def process_numbers_naive(numbers: list[int]) -> list[tuple]:
+    """
+    Обрабатывает пачку чисел по одному
+    """
+    return list(map(process_number, numbers))
+
+
+def process_numbers_sieve(numbers: list[int]) -> list[tuple]:
+    """
+    Обрабатывает пачку чисел, проверяя простоту через общее решето
+    """
+    primes = is_prime_batch(numbers)
+    return [(prime, get_factorial(num)) for prime, num in zip(primes, numbers)]
+
+
+def process_numbers_batch(numbers: list[int], bit_length: bool = False) -> list[tuple]:
+    """
+    Обрабатывает пачку чисел через общее решето и общий проход по факториалам
+    """
+    primes = is_prime_batch(numbers)
+    factorials = factorial_batch(numbers, bit_length=bit_length)
+    return list(zip(primes, factorials))
+
+
+STRATEGIES = {
+    "naive": process_numbers_naive,
+    "sieve": process_numbers_sieve,
+    "batch": process_numbers_batch,
+    "batch_bits": partial(process_numbers_batch, bit_length=True),
+}
+
+
+def split(numbers: list[int], parts: int) -> list[list[int]]:
+    """
+    Делит список на parts примерно равных частей
+    """
+    size = math.ceil(len(numbers) / max(parts, 1)) or 1
+    return [numbers[i : i + size] for i in range(0, len(numbers), size)]
+
+
+def auto_chunksize(count: int, workers: int) -> int:
+    """
+    Подбирает размер пачки так, чтобы на каждый воркер пришлось
+    около четырёх пачек, как это делает multiprocessing.Pool.map
+    """
+    chunksize, extra = divmod(count, max(workers, 1) * 4)
+    return max(chunksize + bool(extra), 1)
+
+
+def chunked(numbers: list[int], chunksize: int) -> list[array]:
     """
-    Обрабатывает данные из очереди
+    Делит список на пачки по chunksize чисел. Пачки хранятся в array,
+    который сериализуется компактнее списка
     """
+    return [
+        array("q", numbers[i : i + chunksize])
+        for i in range(0, len(numbers), chunksize)
+    ]
+
+
+def worker(input_queue, output_queue, worker_id: int, strategy: str = "naive"):
+    """
+    Обрабатывает пачки чисел из очереди и отправляет результаты
+    тоже пачками, по одному сообщению на пачку
+    """
+    process_batch = STRATEGIES[strategy]
     while True:
         try:
             item = input_queue.get()
             if item is None:
                 break
-            output_queue.put(process_number(item))
+            index, chunk = item
+            output_queue.put((index, process_batch(list(chunk))))
         except:
             break
     return None
 
 
-@time_it("sequence")
-def sequence_processing(numbers: list[int]) -> None:
+def sequence_processing(numbers: list[int], strategy: str = "naive") -> list[tuple]:
     """
     Последовательная обработка чисел
     """
-    tuple(map(process_number, numbers))
-    return None
+    return STRATEGIES[strategy](numbers)
 
 
-@time_it("thread_pool")
-def thread_poo_processing(numbers: list[int], max_workers: int | None) -> None:
+def thread_poo_processing(
+    numbers: list[int],
+    max_workers: int | None,
+    strategy: str = "naive",
+) -> list[tuple]:
     """
     Обработка чисел с использованием пула потоков
     """
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        executor.map(process_number, numbers)
-    return None
-
-
-@time_it("process_pool")
-def process_pool_processing(numbers: list[int], max_workers: int | None) -> None:
+        if strategy == "naive":
+            return list(executor.map(process_number, numbers))
+        chunks = split(numbers, max_workers or os.cpu_count() or 1)
+        return list(chain.from_iterable(executor.map(STRATEGIES[strategy], chunks)))
+
+
+def process_pool_processing(
+    numbers: list[int],
+    max_workers: int | None,
+    strategy: str = "naive",
+    chunksize: int | None = None,
+) -> list[tuple]:
     """
-    Обработка чисел с использованием пула процессов
+    Обработка чисел с использованием пула процессов. Числа передаются
+    воркерам пачками по chunksize штук, по умолчанию размер подбирается
+    автоматически
     """
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = chunksize or auto_chunksize(len(numbers), workers)
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        executor.map(process_number, numbers)
-    return None
-
-
-@time_it("maual_processing")
-def maual_processing(numbers: list[int], process_count: int) -> None:
+        if strategy == "naive":
+            return list(executor.map(process_number, numbers, chunksize=chunksize))
+        chunks = chunked(numbers, chunksize)
+        return list(chain.from_iterable(executor.map(STRATEGIES[strategy], chunks)))
+
+
+def maual_processing(
+    numbers: list[int],
+    process_count: int,
+    strategy: str = "naive",
+    chunksize: int | None = None,
+) -> list[tuple]:
     """
-    Обработка чисел с использованием отдельных процессов и очередей
+    Обработка чисел с использованием отдельных процессов и очередей.
+    Числа и результаты передаются через очереди пачками по chunksize штук
     """
     input_queue: Queue = Queue()
     output_queue: Queue = Queue()
 
-    for number in numbers:
-        input_queue.put(number)
+    chunksize = chunksize or auto_chunksize(len(numbers), process_count)
+    chunks = chunked(numbers, chunksize)
+    for item in enumerate(chunks):
+        input_queue.put(item)
 
     for _ in range(process_count):
         input_queue.put(None)
 
     processes = []
     for i in range(process_count):
-        process = Process(target=worker, args=(input_queue, output_queue, i))
+        process = Process(
+            target=worker,
+            args=(input_queue, output_queue, i, strategy),
+        )
         process.start()
         processes.append(process)
 
-    results = []
-    for _ in range(len(numbers)):
-        results.append(output_queue.get())
+    results: list = [None] * len(chunks)
+    for _ in range(len(chunks)):
+        index, batch = output_queue.get()
+        results[index] = batch
 
     for process in processes:
         process.join()
 
+    return list(chain.from_iterable(results))
+
+
+def ipc_messages(title: str, count: int, workers: int) -> int | None:
+    """
+    Считает сообщения между процессами для размера пачки по умолчанию
+    """
+    chunks = math.ceil(count / auto_chunksize(count, workers))
+    if title == "process_pool":
+        return 2 * chunks
+    if title == "maual_processing":
+        return 2 * chunks + workers
     return None
 
 
-def print_data(data: list | tuple) -> None:
+PROCESSORS = {
+    "sequence": lambda numbers, workers, strategy: sequence_processing(
+        numbers, strategy
+    ),
+    "thread_pool": thread_poo_processing,
+    "process_pool": process_pool_processing,
+    "maual_processing": maual_processing,
+}
+
+
+def measure_case(
+    title: str,
+    numbers: list[int],
+    workers: int,
+    strategy: str,
+    repeat: int,
+    warmup: int,
+) -> dict:
+    """
+    Замеряет один обработчик. Вызывается в отдельном процессе через
+    isolated, поэтому обработчик ищется по имени
+    """
+    return measure(
+        PROCESSORS[title],
+        numbers,
+        workers,
+        strategy,
+        repeat=repeat,
+        warmup=warmup,
+    )
+
+
+def run_benchmarks(
+    sizes: list[int],
+    workers_list: list[int],
+    repeat: int,
+    warmup: int,
+) -> list[dict]:
+    """
+    Замеряет все сочетания обработчика, стратегии, размера входа
+    и числа воркеров. Каждое сочетание замеряется в новом процессе,
+    чтобы пиковый RSS относился только к нему
+    """
+    meta = metadata()
+    records = []
+    for size in sizes:
+        numbers = generate_data(size)
+        for workers in workers_list:
+            for strategy in STRATEGIES:
+                for title in PROCESSORS:
+                    stats = isolated(
+                        measure_case,
+                        title,
+                        numbers,
+                        workers,
+                        strategy,
+                        repeat,
+                        warmup,
+                    )
+                    records.append(
+                        {
+                            "name": title,
+                            "strategy": strategy,
+                            "size": size,
+                            "workers": workers,
+                            "ipc_messages": ipc_messages(title, size, workers),
+                            **stats,
+                            **meta,
+                        }
+                    )
+    return records
+
+
+def print_data(data: list | tuple, headers: list[str]) -> None:
     """
     Выводит даныне в виде таблицы
     """
-    headers = ["Функция", "Время выполнения"]
     print(
         tabulate(
             data,
             headers=headers,
             tablefmt="psql",
-            colalign=["left", "right"],
+            colalign=["left"] * 2 + ["right"] * (len(headers) - 2),
         )
     )
 
 
-def frite_data(data: list | tuple, file_path: str) -> None:
+def print_records(records: list[dict]) -> None:
     """
-    Записывает данные в файл
+    Выводит сводку замеров
     """
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=4, ensure_ascii=False)
+    headers = [
+        "Функция",
+        "Алгоритм",
+        "Размер",
+        "Воркеры",
+        "min",
+        "median",
+        "p95",
+        "Чисел в секунду",
+        "IPC в секунду",
+        "Peak RSS, КБ",
+    ]
+    data = [
+        (
+            record["name"],
+            record["strategy"],
+            record["size"],
+            record["workers"],
+            f"{record['min']:.6f}",
+            f"{record['median']:.6f}",
+            f"{record['p95']:.6f}",
+            f"{record['size'] / record['median']:.0f}",
+            (
+                f"{record['ipc_messages'] / record['median']:.0f}"
+                if record["ipc_messages"] is not None
+                else "-"
+            ),
+            record["peak_rss_kb"],
+        )
+        for record in records
+    ]
+    print_data(data, headers)
 
 
-def main() -> None:
-    numbers = generate_data(5000)
-    count = os.cpu_count() or 1
-    data = (
-        sequence_processing(numbers),
-        thread_poo_processing(numbers, count),
-        process_pool_processing(numbers, count),
-        maual_processing(numbers, count),
+def print_comparison(old_path: str, new_path: str, threshold: float) -> bool:
+    """
+    Выводит сравнение двух файлов с замерами. Возвращает True,
+    если найдены регрессии
+    """
+    rows = compare(old_path, new_path, threshold)
+    headers = ["Функция", "Алгоритм", "Размер", "Воркеры", "Было", "Стало", "Δ", ""]
+    data = [
+        (
+            *key,
+            f"{old:.6f}",
+            f"{new:.6f}",
+            f"{change:+.1%}",
+            "REGRESSION" if regression else "",
+        )
+        for key, old, new, change, regression in rows
+    ]
+    print_data(data, headers)
+    return any(row[-1] for row in rows)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк обработки чисел")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count() or 1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", default="results.jsonl")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="сравнить два файла с замерами вместо запуска",
     )
-    frite_data(data, "results.jsonl")
-    print_data(data)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.compare:
+        if print_comparison(*args.compare, args.threshold):
+            sys.exit(1)
+        return
+    records = run_benchmarks(args.sizes, args.workers, args.repeat, args.warmup)
+    write_jsonl(records, args.output)
+    print_records(records)
 
 
 if __name__ == "__main__":
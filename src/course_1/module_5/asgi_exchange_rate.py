@@ -1,28 +1,40 @@
 # Запуск через uvicorn из корневой папки репозитория:
 #     uvicorn srs.module_5.asgi_exchange_rate:app --host 0.0.0.0 --port 8000
 
+import asyncio
 import json
 import logging
 from functools import wraps
+from time import perf_counter
 
 import aiohttp
 from aiohttp.client_exceptions import (
     ClientConnectorDNSError,
+    ClientResponseError,
     InvalidURL,
     ServerTimeoutError,
 )
+from log_config import ACCESS_KEY, log_access, setup_logging
+from rate_cache import MISS, STALE, RateCache, cache_headers
+from rate_matrix import BASE_CURRENCY, RateMatrix
 
 API_URL = "https://api.exchangerate-api.com/v4/latest/{}"
+CONNECTOR_LIMIT = 100
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=3)
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="[%(asctime)s] %(levelname)s %(name)s %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[logging.StreamHandler()],
-)
+setup_logging()
 
 logger = logging.getLogger("WSGI")
 
+session: aiohttp.ClientSession | None = None
+rate_cache = RateCache()
+# Ссылки на фоновые обновления, чтобы задачи не собрал сборщик мусора
+refresh_tasks: set[asyncio.Task] = set()
+# Запросы к api в полёте по символам валют для объединения одинаковых
+inflight: dict[str, asyncio.Task] = {}
+
 
 class NotFound(Exception):
     pass
@@ -52,24 +64,79 @@ def get_currency_signs(scope: dict) -> str:
     Извлекает символы валюты из uri
     """
     raw_uri = scope.get("path", "/")
-    logger.debug("scope.path: %s", raw_uri)
     validate_raw_uri(raw_uri)
     signs = raw_uri.split("/")[1].lower()
     validate_signs(signs)
-    logger.debug("Prefix is %s", signs)
     return signs
 
 
+def get_target_signs(scope: dict) -> str | None:
+    """
+    Извлекает символы второй валюты из uri вида /<from>/<to>
+    """
+    parts = scope.get("path", "/").split("/")
+    if len(parts) < 3 or not parts[2]:
+        return None
+    signs = parts[2].lower()
+    validate_signs(signs)
+    return signs
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Создаёт сессию с пулом соединений, общую для всех запросов
+    """
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTOR_LIMIT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую сессию. Если сервер не поддерживает lifespan,
+    сессия создаётся при первом запросе
+    """
+    global session
+    if session is None or session.closed:
+        session = create_session()
+    return session
+
+
+async def lifespan(receive, send) -> None:
+    """
+    Обрабатывает протокол ASGI lifespan: открывает общую сессию
+    при старте и закрывает её при остановке
+    """
+    global session
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            session = create_session()
+            logger.info("Shared ClientSession created")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            pending = [*refresh_tasks, *inflight.values()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if session is not None:
+                await session.close()
+                session = None
+            logger.info("Shared ClientSession closed")
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
 async def get_exchange_rate(
     currency_signs: str, session: aiohttp.ClientSession
 ) -> bytes:
     """
     Получает данные от стороннего api для указанных символов валют
     """
-    logger.debug("URL for request: %s", API_URL.format(currency_signs))
     async with session.get(API_URL.format(currency_signs)) as response:
-        logger.debug("Currency signs: %s", currency_signs)
-        logger.debug("Status code: %s", response.status)
         if response.status == 404:
             logger.error(
                 "Request error: %s. Currency signs: %s.",
@@ -77,10 +144,69 @@ async def get_exchange_rate(
                 currency_signs,
             )
             raise ValueError("Currency signs are not valid")
+        response.raise_for_status()
         content = await response.read()
         return content
 
 
+async def fetch_exchange_rate(currency_signs: str) -> bytes:
+    """
+    Получает данные api, объединяя одновременные запросы одной валюты:
+    первый запускает задачу, остальные ждут её результата или ошибки.
+    Задача защищена через shield, поэтому отмена одного ожидающего
+    не прерывает запрос для остальных
+    """
+    task = inflight.get(currency_signs)
+    if task is None:
+        task = asyncio.create_task(get_exchange_rate(currency_signs, get_session()))
+        inflight[currency_signs] = task
+
+        def forget(task: asyncio.Task) -> None:
+            if inflight.get(currency_signs) is task:
+                del inflight[currency_signs]
+            # Ошибку забираем, даже если все ожидающие отменены,
+            # иначе asyncio пишет в лог "exception was never retrieved"
+            if not task.cancelled():
+                task.exception()
+
+        task.add_done_callback(forget)
+    else:
+        logger.debug("Joined in-flight request for %s", currency_signs)
+    return await asyncio.shield(task)
+
+
+async def refresh_rate_matrix() -> None:
+    """
+    Обновляет устаревшую таблицу курсов в кеше. При ошибке старая
+    таблица продолжает использоваться до конца окна stale
+    """
+    matrix = None
+    try:
+        matrix = RateMatrix.from_json(await fetch_exchange_rate(BASE_CURRENCY))
+    except Exception as exc:
+        logger.error("Refresh error: %s. Currency signs: %s.", exc, BASE_CURRENCY)
+    finally:
+        rate_cache.end_refresh(BASE_CURRENCY, matrix)
+
+
+async def get_rate_matrix() -> tuple[RateMatrix, list[tuple[str, str]]]:
+    """
+    Возвращает таблицу курсов из кеша и заголовки с её состоянием.
+    Из api загружается только таблица BASE_CURRENCY, остальные базы
+    считаются из неё. Устаревшая таблица отдаётся сразу, а обновляется
+    одной фоновой задачей
+    """
+    matrix, state, age = rate_cache.get(BASE_CURRENCY)
+    if state == MISS:
+        matrix = RateMatrix.from_json(await fetch_exchange_rate(BASE_CURRENCY))
+        rate_cache.set(BASE_CURRENCY, matrix)
+    elif state == STALE and rate_cache.begin_refresh(BASE_CURRENCY):
+        task = asyncio.create_task(refresh_rate_matrix())
+        refresh_tasks.add(task)
+        task.add_done_callback(refresh_tasks.discard)
+    return matrix, cache_headers(state, age)
+
+
 async def exception_response(
     send,
     status: int,
@@ -123,7 +249,13 @@ def exception_handler(headers):
                     headers=headers,
                     message=str(exc),
                 )
-            except (ClientConnectorDNSError, ServerTimeoutError, InvalidURL) as exc:
+            except (
+                ClientConnectorDNSError,
+                ClientResponseError,
+                ServerTimeoutError,
+                InvalidURL,
+                TimeoutError,
+            ) as exc:
                 logger.error("Error: %s", exc)
                 return await exception_response(
                     send,
@@ -145,15 +277,24 @@ def exception_handler(headers):
 
 
 @exception_handler([("Content-Type", "application/json")])
-async def app(scope, receive, send, headers):
+async def exchange_rate_app(scope, receive, send, headers):
     currency_signs = get_currency_signs(scope)
-    async with aiohttp.ClientSession() as session:
-        exchange_rate_data = await get_exchange_rate(currency_signs, session)
+    target_signs = get_target_signs(scope)
+    started = perf_counter()
+    matrix, extra_headers = await get_rate_matrix()
+    exchange_rate_data = matrix.body(currency_signs, target_signs)
+    if ACCESS_KEY in scope:
+        cache = dict(extra_headers)
+        scope[ACCESS_KEY].update(
+            cache=cache["X-Cache"],
+            age=int(cache["Age"]),
+            rates_ms=round((perf_counter() - started) * 1000, 3),
+        )
     await send(
         {
             "type": "http.response.start",
             "status": 200,
-            "headers": headers,
+            "headers": headers + extra_headers,
         }
     )
     await send(
@@ -162,3 +303,22 @@ async def app(scope, receive, send, headers):
             "body": exchange_rate_data,
         },
     )
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    started = perf_counter()
+    access = {"method": scope.get("method"), "path": scope.get("path"), "status": 0}
+    scope[ACCESS_KEY] = access
+
+    async def send_with_status(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            access["status"] = message["status"]
+        await send(message)
+
+    try:
+        return await exchange_rate_app(scope, receive, send_with_status)
+    finally:
+        access["duration_ms"] = round((perf_counter() - started) * 1000, 3)
+        log_access(access)
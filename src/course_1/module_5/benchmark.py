@@ -0,0 +1,540 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+from collections import Counter
+from collections.abc import AsyncIterator, Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from time import perf_counter
+
+import aiohttp
+from aiohttp import web
+
+HOST = "127.0.0.1"
+PORT = 8766
+CURRENCIES = ("usd", "eur", "rub", "gbp", "jpy", "cny")
+
+
+def rates_table(base: str) -> dict:
+    """
+    Возвращает таблицу курсов в формате api.exchangerate-api.com
+    """
+    usd_rates = {
+        "USD": 1.0,
+        "EUR": 0.9,
+        "RUB": 80.0,
+        "GBP": 0.75,
+        "JPY": 150.0,
+        "CNY": 7.2,
+    }
+    base_rate = usd_rates[base.upper()]
+    return {
+        "provider": "https://www.exchangerate-api.com",
+        "base": base.upper(),
+        "date": "2026-10-18",
+        "time_last_updated": 1792281601,
+        "rates": {currency: rate / base_rate for currency, rate in usd_rates.items()},
+    }
+
+
+@asynccontextmanager
+async def stub_upstream(
+    delay: float = 0.0,
+    host: str = HOST,
+    port: int = PORT,
+) -> AsyncIterator[tuple[str, Counter]]:
+    """
+    Поднимает локальную заглушку api курсов валют. Возвращает шаблон url
+    для API_URL и счётчик обращений по валютам
+    """
+    hits: Counter = Counter()
+
+    async def handle(request: web.Request) -> web.Response:
+        currency = request.match_info["currency"].lower()
+        hits[currency] += 1
+        if delay:
+            await asyncio.sleep(delay)
+        if currency.upper() not in rates_table("usd")["rates"]:
+            return web.Response(status=404)
+        return web.json_response(rates_table(currency))
+
+    app = web.Application()
+    app.router.add_get("/v4/latest/{currency}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        yield f"http://{host}:{port}/v4/latest/{{}}", hits
+    finally:
+        await runner.cleanup()
+
+
+def wsgi_request(app, path: str) -> tuple[int, bytes]:
+    """
+    Выполняет один запрос к WSGI-приложению без сервера
+    """
+    environ = {"REQUEST_METHOD": "GET", "RAW_URI": path, "PATH_INFO": path}
+    response: dict = {"status": 0}
+
+    def start_response(status: str, headers: list, exc_info=None) -> None:
+        response["status"] = int(status.split()[0])
+
+    body = b"".join(app(environ, start_response))
+    return response["status"], body
+
+
+async def asgi_request(app, path: str) -> tuple[int, bytes]:
+    """
+    Выполняет один запрос к ASGI-приложению без сервера
+    """
+    scope = {"type": "http", "method": "GET", "path": path, "headers": []}
+    response: dict = {"status": 0, "body": b""}
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["body"]
+
+
+@asynccontextmanager
+async def asgi_lifespan(app) -> AsyncIterator[None]:
+    """
+    Проводит ASGI-приложение через startup и shutdown
+    """
+    messages: asyncio.Queue = asyncio.Queue()
+    sent: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(
+        app({"type": "lifespan"}, messages.get, sent.put),
+    )
+    await messages.put({"type": "lifespan.startup"})
+    await sent.get()
+    try:
+        yield
+    finally:
+        await messages.put({"type": "lifespan.shutdown"})
+        await sent.get()
+        await task
+
+
+async def run_load(
+    call: Callable[[int], Awaitable],
+    requests: int,
+    concurrency: int,
+) -> dict:
+    """
+    Выполняет requests вызовов call с заданной параллельностью
+    и возвращает пропускную способность и перцентили задержки
+    """
+    latencies: list[float] = []
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        for i in counter:
+            start = perf_counter()
+            await call(i)
+            latencies.append(perf_counter() - start)
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": round(requests / elapsed),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+
+async def benchmark_session(args: argparse.Namespace) -> None:
+    """
+    Сравнивает новую сессию на каждый запрос с общей сессией из lifespan.
+    Оба варианта вызывают get_exchange_rate напрямую, минуя кеш
+    и объединение одновременных запросов, чтобы каждый запрос шёл
+    в заглушку и сравнивалась только стоимость сессии
+    """
+    import asgi_exchange_rate
+
+    logging.getLogger().setLevel(logging.WARNING)
+    async with stub_upstream(args.delay) as (api_url, hits):
+        asgi_exchange_rate.API_URL = api_url
+
+        async def per_request(i: int) -> None:
+            currency = CURRENCIES[i % len(CURRENCIES)]
+            async with aiohttp.ClientSession() as session:
+                await asgi_exchange_rate.get_exchange_rate(currency, session)
+
+        result = await run_load(per_request, args.requests, args.concurrency)
+        result["upstream"] = sum(hits.values())
+        print("per_request_session", json.dumps(result))
+
+        hits.clear()
+        async with asgi_lifespan(asgi_exchange_rate.app):
+
+            async def shared(i: int) -> None:
+                currency = CURRENCIES[i % len(CURRENCIES)]
+                session = asgi_exchange_rate.get_session()
+                await asgi_exchange_rate.get_exchange_rate(currency, session)
+
+            result = await run_load(shared, args.requests, args.concurrency)
+            result["upstream"] = sum(hits.values())
+            print("shared_session", json.dumps(result))
+
+
+async def benchmark_cache(args: argparse.Namespace) -> None:
+    """
+    Сравнивает приложения без кеша и с кешем курсов. Короткий fresh_ttl
+    заставляет кеш постоянно уходить в stale и обновляться в фоне
+    """
+    import asgi_exchange_rate
+    import wsgi_exchange_rate
+    from rate_cache import RateCache
+
+    logging.getLogger().setLevel(logging.WARNING)
+    executor = ThreadPoolExecutor(args.concurrency)
+    loop = asyncio.get_running_loop()
+    modes = {
+        "no_cache": RateCache(fresh_ttl=0, stale_ttl=0),
+        "fresh_only": RateCache(fresh_ttl=60, stale_ttl=0),
+        "stale_while_revalidate": RateCache(fresh_ttl=0.05, stale_ttl=60),
+    }
+    async with stub_upstream(args.delay) as (api_url, hits):
+        asgi_exchange_rate.API_URL = api_url
+        wsgi_exchange_rate.API_URL = api_url
+        async with asgi_lifespan(asgi_exchange_rate.app):
+            for mode, cache in modes.items():
+                asgi_exchange_rate.rate_cache = cache
+                hits.clear()
+
+                async def asgi_call(i: int) -> None:
+                    path = f"/{CURRENCIES[i % len(CURRENCIES)]}"
+                    await asgi_request(asgi_exchange_rate.app, path)
+
+                result = await run_load(asgi_call, args.requests, args.concurrency)
+                result["upstream"] = sum(hits.values())
+                result["hit_rate"] = round(cache.info().hit_rate, 3)
+                print("asgi", mode, json.dumps(result))
+
+        for mode, cache in modes.items():
+            wsgi_exchange_rate.rate_cache = RateCache(cache.fresh_ttl, cache.stale_ttl)
+            hits.clear()
+
+            async def wsgi_call(i: int) -> None:
+                path = f"/{CURRENCIES[i % len(CURRENCIES)]}"
+                await loop.run_in_executor(
+                    executor, wsgi_request, wsgi_exchange_rate.app, path
+                )
+
+            result = await run_load(wsgi_call, args.requests, args.concurrency)
+            result["upstream"] = sum(hits.values())
+            result["hit_rate"] = round(wsgi_exchange_rate.rate_cache.info().hit_rate, 3)
+            print("wsgi", mode, json.dumps(result))
+    executor.shutdown()
+
+
+async def benchmark_coalesce(args: argparse.Namespace) -> None:
+    """
+    Проверяет объединение одновременных запросов: args.concurrency
+    клиентов одновременно спрашивают одну валюту при пустом кеше.
+    Считает обращения к заглушке, проверяет распространение ошибок
+    и то, что отмена ожидающих не прерывает общий запрос
+    """
+    import asgi_exchange_rate
+    from rate_cache import RateCache
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    clients = args.concurrency
+    async with stub_upstream(args.delay) as (api_url, hits):
+        asgi_exchange_rate.API_URL = api_url
+        async with asgi_lifespan(asgi_exchange_rate.app):
+            session = asgi_exchange_rate.get_session()
+
+            start = perf_counter()
+            await asyncio.gather(
+                *(
+                    asgi_exchange_rate.get_exchange_rate("usd", session)
+                    for _ in range(clients)
+                )
+            )
+            elapsed = perf_counter() - start
+            print(f"direct: {hits['usd']} upstream calls, {elapsed * 1000:.1f} ms")
+
+            hits.clear()
+            asgi_exchange_rate.rate_cache = RateCache()
+            start = perf_counter()
+            responses = await asyncio.gather(
+                *(asgi_request(asgi_exchange_rate.app, "/usd") for _ in range(clients))
+            )
+            elapsed = perf_counter() - start
+            print(f"coalesced: {hits['usd']} upstream calls, {elapsed * 1000:.1f} ms")
+            assert hits["usd"] == 1
+            assert all(status == 200 for status, _ in responses)
+            assert len({body for _, body in responses}) == 1
+
+            # Ошибка api доходит до каждого ожидающего
+            hits.clear()
+            results = await asyncio.gather(
+                *(
+                    asgi_exchange_rate.fetch_exchange_rate("xyz")
+                    for _ in range(clients)
+                ),
+                return_exceptions=True,
+            )
+            assert hits["xyz"] == 1
+            assert all(isinstance(result, ValueError) for result in results)
+            print(f"errors: {hits['xyz']} upstream call, {clients} x ValueError")
+
+            # Отмена части ожидающих не мешает остальным
+            hits.clear()
+            waiters = [
+                asyncio.create_task(asgi_exchange_rate.fetch_exchange_rate("eur"))
+                for _ in range(clients)
+            ]
+            await asyncio.sleep(0)
+            for waiter in waiters[1:]:
+                waiter.cancel()
+            assert await waiters[0]
+            assert hits["eur"] == 1
+
+            # Отмена всех ожидающих не прерывает сам запрос
+            waiters = [
+                asyncio.create_task(asgi_exchange_rate.fetch_exchange_rate("gbp"))
+                for _ in range(clients)
+            ]
+            await asyncio.sleep(0)
+            shared = asgi_exchange_rate.inflight["gbp"]
+            for waiter in waiters:
+                waiter.cancel()
+            assert await shared
+            assert "gbp" not in asgi_exchange_rate.inflight
+            print("cancellation: shared fetch survived cancelled waiters")
+
+
+async def benchmark_matrix(args: argparse.Namespace) -> None:
+    """
+    Проверяет, что таблицы, посчитанные из одной базы, совпадают
+    по формату и значениям с таблицами api, и считает обращения к api
+    при запросах по всем базам и парам
+    """
+    import asgi_exchange_rate
+    from rate_cache import RateCache
+    from rate_matrix import RateMatrix
+
+    logging.getLogger().setLevel(logging.WARNING)
+    matrix = RateMatrix(rates_table("usd"))
+    for base in CURRENCIES:
+        expected = rates_table(base)
+        computed = matrix.convert(base)
+        assert list(computed) == list(expected)
+        assert list(computed["rates"]) == list(expected["rates"])
+        for code, rate in expected["rates"].items():
+            assert abs(computed["rates"][code] - rate) <= rate * 1e-5
+    print("layout: all bases match the upstream tables")
+
+    start = perf_counter()
+    for _ in range(args.requests):
+        matrix.rate("eur", "rub")
+    elapsed = perf_counter() - start
+    print(f"rate(): {elapsed / args.requests * 1e9:.0f} ns per conversion")
+
+    paths = [f"/{base}" for base in CURRENCIES]
+    paths += [f"/{source}/{target}" for source in CURRENCIES for target in CURRENCIES]
+    async with stub_upstream(args.delay) as (api_url, hits):
+        asgi_exchange_rate.API_URL = api_url
+        asgi_exchange_rate.rate_cache = RateCache()
+        async with asgi_lifespan(asgi_exchange_rate.app):
+
+            async def call(i: int) -> None:
+                status, _ = await asgi_request(
+                    asgi_exchange_rate.app, paths[i % len(paths)]
+                )
+                assert status == 200
+
+            result = await run_load(call, args.requests, args.concurrency)
+        result["paths"] = len(paths)
+        result["upstream"] = sum(hits.values())
+        print("matrix", json.dumps(result))
+
+
+GUNICORN_PORT = 8767
+GUNICORN_CONFIG = """
+import logging
+
+import requests
+import wsgi_exchange_rate
+from gunicorn_conf import *
+from rate_cache import RateCache
+
+loglevel = "warning"
+
+
+def post_fork(server, worker):
+    logging.getLogger().setLevel(logging.WARNING)
+    wsgi_exchange_rate.API_URL = {api_url!r}
+    # Кеш выключен, чтобы каждый запрос шёл в заглушку
+    wsgi_exchange_rate.rate_cache = RateCache(fresh_ttl=0, stale_ttl=0)
+    if {legacy}:
+        # Прежнее поведение: requests.get без сессии и таймаутов
+        wsgi_exchange_rate.get_session = lambda: requests
+    else:
+        wsgi_exchange_rate.init_session(worker.cfg.threads)
+"""
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 10.0) -> None:
+    deadline = perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            await writer.wait_closed()
+            return
+
+
+async def benchmark_gunicorn(args: argparse.Namespace) -> None:
+    """
+    Нагружает WSGI-приложение под gunicorn с кешем курсов выключенным:
+    requests.get на каждый запрос против сессии с пулом на воркер
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    url = f"http://{HOST}:{GUNICORN_PORT}/usd"
+    async with stub_upstream(args.delay) as (api_url, hits):
+        for mode, legacy in (("requests_get", True), ("pooled_session", False)):
+            hits.clear()
+            with tempfile.NamedTemporaryFile("w", suffix=".py") as config:
+                config.write(GUNICORN_CONFIG.format(api_url=api_url, legacy=legacy))
+                config.flush()
+                server = await asyncio.create_subprocess_exec(
+                    sys.executable,
+                    "-m",
+                    "gunicorn",
+                    "--config",
+                    config.name,
+                    "--pythonpath",
+                    directory,
+                    "--chdir",
+                    directory,
+                    "--bind",
+                    f"{HOST}:{GUNICORN_PORT}",
+                    "wsgi_exchange_rate:app",
+                )
+                try:
+                    await wait_for_port(HOST, GUNICORN_PORT)
+                    async with aiohttp.ClientSession() as client:
+
+                        async def call(i: int) -> None:
+                            async with client.get(url) as response:
+                                await response.read()
+                                assert response.status == 200
+
+                        result = await run_load(call, args.requests, args.concurrency)
+                finally:
+                    server.terminate()
+                    await server.wait()
+            result["upstream"] = sum(hits.values())
+            print("gunicorn", mode, json.dumps(result))
+
+
+LEGACY_DEBUG_LINES = (
+    "scope.path: %s",
+    "Prefix is %s",
+    "URL for request: %s",
+    "Currency signs: %s",
+    "Status code: %s",
+    "Cache state: %s",
+)
+
+
+async def benchmark_logging(args: argparse.Namespace) -> None:
+    """
+    Сравнивает накладные расходы логирования на запрос в ASGI-приложении
+    с прогретым кешем: прежние шесть строк DEBUG через StreamHandler
+    прямо в цикле событий против QueueHandler и одной строки access-лога
+    """
+    import asgi_exchange_rate
+    import log_config
+
+    logger = logging.getLogger("WSGI")
+
+    async def legacy_app(scope, receive, send) -> None:
+        for line in LEGACY_DEBUG_LINES:
+            logger.debug(line, scope["path"])
+        await asgi_exchange_rate.exchange_rate_app(scope, receive, send)
+
+    async with stub_upstream(args.delay) as (api_url, hits):
+        asgi_exchange_rate.API_URL = api_url
+        log_config.setup_logging(logging.WARNING)
+        async with asgi_lifespan(asgi_exchange_rate.app):
+            await asgi_request(asgi_exchange_rate.app, "/usd")
+            for mode, application in (
+                ("no_logging", asgi_exchange_rate.exchange_rate_app),
+                ("sync_debug_lines", legacy_app),
+                ("queue_access_line", asgi_exchange_rate.app),
+            ):
+                with tempfile.TemporaryFile("w+") as stream:
+                    if mode == "sync_debug_lines":
+                        handler = logging.StreamHandler(stream)
+                        handler.setFormatter(
+                            logging.Formatter(
+                                log_config.LOG_FORMAT, log_config.DATE_FORMAT
+                            )
+                        )
+                        root = logging.getLogger()
+                        root.handlers[:] = [handler]
+                        root.setLevel(logging.DEBUG)
+                    else:
+                        log_config.setup_logging(logging.INFO, stream)
+
+                    async def call(i: int) -> None:
+                        await asgi_request(
+                            application, f"/{CURRENCIES[i % len(CURRENCIES)]}"
+                        )
+
+                    result = await run_load(call, args.requests, args.concurrency)
+                    log_config.stop_logging()
+                    stream.seek(0)
+                    result["log_lines"] = sum(1 for _ in stream)
+                    log_config.setup_logging(logging.WARNING)
+                result["us_per_request"] = round(1_000_000 / result["rps"], 1)
+                print("logging", mode, json.dumps(result))
+
+
+BENCHMARKS = {
+    "session": benchmark_session,
+    "cache": benchmark_cache,
+    "coalesce": benchmark_coalesce,
+    "matrix": benchmark_matrix,
+    "gunicorn": benchmark_gunicorn,
+    "logging": benchmark_logging,
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарки сервисов курсов валют")
+    parser.add_argument("name", choices=BENCHMARKS)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    benchmark = BENCHMARKS[args.name]
+    asyncio.run(benchmark(args))
@@ -0,0 +1,16 @@
+# Настройки gunicorn для wsgi_exchange_rate, см. комментарий в его начале
+
+workers = 2
+threads = 10
+worker_class = "gthread"
+timeout = 30
+
+
+def post_fork(server, worker):
+    """
+    Создаёт в каждом воркере свою сессию requests с пулом соединений
+    по числу потоков
+    """
+    import wsgi_exchange_rate
+
+    wsgi_exchange_rate.init_session(worker.cfg.threads)
@@ -0,0 +1,94 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "[%(asctime)s] %(levelname)s %(name)s %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+ACCESS_KEY = "exchange_rate.access"
+
+access_logger = logging.getLogger("access")
+listener: QueueListener | None = None
+fork_handler_registered = False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Кладёт запись в очередь как есть. Стандартный QueueHandler
+    форматирует сообщение ещё в потоке запроса, здесь это делает
+    обработчик в потоке QueueListener
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Записи access-лога с полем fields выводит одной строкой JSON,
+    остальные - по обычному формату
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None)
+        if fields is None:
+            return super().format(record)
+        return json.dumps(
+            {
+                "time": self.formatTime(record, self.datefmt),
+                "level": record.levelname,
+                "logger": record.name,
+                **fields,
+            }
+        )
+
+
+def setup_logging(level: str | int = LOG_LEVEL, stream=None) -> QueueListener:
+    """
+    Направляет все записи через очередь в отдельный поток, который
+    пишет их в stream. Запрос только кладёт запись в очередь и не ждёт
+    записи в stderr. После fork поток слушателя в дочернем процессе
+    не существует, поэтому он запускается заново
+    """
+    global listener, fork_handler_registered
+    stop_logging()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(StructuredFormatter(LOG_FORMAT, DATE_FORMAT))
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+    if not fork_handler_registered:
+        os.register_at_fork(after_in_child=lambda: setup_logging(level, stream))
+        fork_handler_registered = True
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_logging() -> None:
+    """
+    Дописывает оставшиеся в очереди записи и останавливает поток
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(stop_logging)
+
+
+def log_access(fields: dict) -> None:
+    """
+    Пишет одну строку access-лога. Поля собираются в словарь,
+    а в JSON превращаются уже в потоке слушателя
+    """
+    if access_logger.isEnabledFor(logging.INFO):
+        access_logger.info("access", extra={"fields": fields})
@@ -0,0 +1,133 @@
+import threading
+from collections.abc import Callable
+from time import monotonic
+from typing import Any, NamedTuple
+
+FRESH_TTL = 300.0
+STALE_TTL = 3600.0
+
+FRESH = "HIT"
+STALE = "STALE"
+MISS = "MISS"
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    stale_hits: int
+    misses: int
+    refreshes: int
+    refresh_errors: int
+    currsize: int
+    hit_rate: float
+    ages: dict[str, float]
+
+
+class RateCache:
+    """
+    Кеш ответов api курсов по символам валюты. Значение может быть
+    любым объектом, например телом ответа или RateMatrix. Пока
+    с момента загрузки прошло меньше fresh_ttl секунд, ответ свежий.
+    Следующие stale_ttl секунд ответ отдаётся сразу, но вызывающий код
+    должен обновить его в фоне: begin_refresh разрешает это только
+    одному запросу на валюту. Старше ответ считается отсутствующим.
+    Потокобезопасен, поэтому подходит и для WSGI с потоками, и для ASGI
+    """
+
+    def __init__(
+        self,
+        fresh_ttl: float = FRESH_TTL,
+        stale_ttl: float = STALE_TTL,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.entries: dict[str, tuple[Any, float]] = {}
+        self.refreshing: set[str] = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def get(self, currency: str) -> tuple[Any, str, float]:
+        """
+        Возвращает (значение, состояние, возраст в секундах).
+        Состояние - FRESH, STALE или MISS, при MISS значение равно None
+        """
+        with self.lock:
+            entry = self.entries.get(currency)
+            if entry is not None:
+                value, stored = entry
+                age = self.clock() - stored
+                if age < self.fresh_ttl:
+                    self.hits += 1
+                    return value, FRESH, age
+                if age < self.fresh_ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    return value, STALE, age
+                del self.entries[currency]
+            self.misses += 1
+            return None, MISS, 0.0
+
+    def set(self, currency: str, value: Any) -> None:
+        with self.lock:
+            self.entries[currency] = (value, self.clock())
+
+    def begin_refresh(self, currency: str) -> bool:
+        """
+        Отмечает начало фонового обновления. Возвращает False,
+        если обновление этой валюты уже идёт
+        """
+        with self.lock:
+            if currency in self.refreshing:
+                return False
+            self.refreshing.add(currency)
+            self.refreshes += 1
+            return True
+
+    def end_refresh(self, currency: str, value: Any) -> None:
+        """
+        Завершает фоновое обновление. value=None означает ошибку:
+        старый ответ остаётся в кеше до конца окна stale_ttl
+        """
+        with self.lock:
+            self.refreshing.discard(currency)
+            if value is None:
+                self.refresh_errors += 1
+            else:
+                self.entries[currency] = (value, self.clock())
+
+    def info(self) -> CacheInfo:
+        with self.lock:
+            now = self.clock()
+            requests = self.hits + self.stale_hits + self.misses
+            served = self.hits + self.stale_hits
+            return CacheInfo(
+                self.hits,
+                self.stale_hits,
+                self.misses,
+                self.refreshes,
+                self.refresh_errors,
+                len(self.entries),
+                served / requests if requests else 0.0,
+                {
+                    currency: round(now - stored, 3)
+                    for currency, (_, stored) in self.entries.items()
+                },
+            )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.refreshing.clear()
+            self.hits = self.stale_hits = self.misses = 0
+            self.refreshes = self.refresh_errors = 0
+
+
+def cache_headers(state: str, age: float) -> list[tuple[str, str]]:
+    """
+    Заголовки, по которым клиент видит состояние кеша и возраст ответа
+    """
+    return [("X-Cache", state), ("Age", str(int(age)))]
@@ -0,0 +1,97 @@
+import json
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BASE_CURRENCY = "usd"
+SIGNIFICANT_DIGITS = 6
+
+
+class RateMatrix:
+    """
+    Курсы всех валют, посчитанные из одной таблицы api. В таблице
+    с базой B хранится, сколько единиц каждой валюты дают за одну B,
+    поэтому курс X к Y равен rates[Y] / rates[X]. Таблица для новой
+    базы считается одним делением всего массива, ответы кешируются.
+    Курсы от собственной базы таблицы не пересчитываются и не округляются,
+    а сама таблица отдаётся байт в байт так, как её вернул api
+    """
+
+    def __init__(self, table: dict, content: bytes | None = None):
+        self.table = table
+        self.base = table["base"].upper()
+        self.codes = tuple(table["rates"])
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        values = table["rates"].values()
+        if numpy is not None:
+            self.values = numpy.fromiter(values, dtype=float, count=len(self.codes))
+        else:
+            self.values = array("d", values)
+        self.bodies: dict[tuple[str, str | None], bytes] = {}
+        if content is not None:
+            self.bodies[(self.base, None)] = content
+
+    @classmethod
+    def from_json(cls, content: bytes) -> "RateMatrix":
+        return cls(json.loads(content), content)
+
+    def position(self, currency: str) -> int:
+        try:
+            return self.index[currency.upper()]
+        except KeyError:
+            raise ValueError("Currency signs are not valid") from None
+
+    def rate(self, source: str, target: str) -> float:
+        """
+        Возвращает курс source к target за O(1)
+        """
+        return self.values[self.position(target)] / self.values[self.position(source)]
+
+    def rates(self, base: str) -> list[float]:
+        """
+        Возвращает курсы всех валют к base в порядке self.codes
+        """
+        divisor = self.values[self.position(base)]
+        if numpy is not None:
+            return (self.values / divisor).tolist()
+        return [value / divisor for value in self.values]
+
+    def convert(self, base: str, target: str | None = None) -> dict:
+        """
+        Возвращает таблицу в формате api для базы base. Если задан
+        target, в rates остаётся только курс к нему
+        """
+        if base.upper() == self.base:
+            if target is None:
+                return self.table
+            rates = {target.upper(): float(self.values[self.position(target)])}
+        elif target is None:
+            rates = dict(zip(self.codes, map(round_rate, self.rates(base))))
+        else:
+            rates = {target.upper(): round_rate(self.rate(base, target))}
+        # Порядок и состав полей повторяют исходную таблицу api
+        return {
+            key: base.upper() if key == "base" else rates if key == "rates" else value
+            for key, value in self.table.items()
+        }
+
+    def body(self, base: str, target: str | None = None) -> bytes:
+        """
+        Возвращает сериализованную таблицу для base или пары base/target
+        """
+        key = (base.upper(), target.upper() if target else None)
+        body = self.bodies.get(key)
+        if body is None:
+            body = json.dumps(self.convert(base, target)).encode()
+            self.bodies[key] = body
+        return body
+
+
+def round_rate(rate: float) -> float:
+    """
+    Убирает хвост ошибки деления, оставляя SIGNIFICANT_DIGITS цифр
+    """
+    return float(f"{rate:.{SIGNIFICANT_DIGITS}g}")
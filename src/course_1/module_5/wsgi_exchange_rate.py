@@ -1,24 +1,37 @@
 # Запуск через gunicorn из корневой папки репозитория:
-#     gunicorn srs.module_5.wsgi_exchange_rate:app --host 0.0.0.0 --port 8000
+#     gunicorn --chdir src/course_1/module_5 -c gunicorn_conf.py \
+#         wsgi_exchange_rate:app --bind 0.0.0.0:8000
 
 import json
 import logging
+import os
+import threading
 from functools import wraps
+from time import perf_counter
 
 import requests
+from log_config import ACCESS_KEY, log_access, setup_logging
+from rate_cache import MISS, STALE, RateCache, cache_headers
+from rate_matrix import BASE_CURRENCY, RateMatrix
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, HTTPError, InvalidURL, Timeout
 
 API_URL = "https://api.exchangerate-api.com/v4/latest/{}"
+POOL_SIZE = 10
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="[%(asctime)s] %(levelname)s %(name)s %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[logging.StreamHandler()],
-)
+setup_logging()
 
 logger = logging.getLogger("WSGI")
 
+rate_cache = RateCache()
+
+session: requests.Session | None = None
+session_pid: int | None = None
+session_pool_size = POOL_SIZE
+session_lock = threading.Lock()
+
 
 class NotFound(Exception):
     pass
@@ -48,28 +61,109 @@ def get_currency_signs(environ: dict) -> str:
     Извлекает символы валюты из uri
     """
     raw_uri = environ.get("RAW_URI", "/")
-    logger.debug("environ.RAW_URI: %s", raw_uri)
     validate_raw_uri(raw_uri)
     signs = raw_uri.split("/")[1].lower()
     validate_signs(signs)
-    logger.debug("Prefix is %s", signs)
     return signs
 
 
+def get_target_signs(environ: dict) -> str | None:
+    """
+    Извлекает символы второй валюты из uri вида /<from>/<to>
+    """
+    parts = environ.get("RAW_URI", "/").split("/")
+    if len(parts) < 3 or not parts[2]:
+        return None
+    signs = parts[2].lower()
+    validate_signs(signs)
+    return signs
+
+
+def create_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """
+    Создаёт сессию с пулом на pool_size соединений к каждому хосту
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    new_session = requests.Session()
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    return new_session
+
+
+def init_session(pool_size: int = POOL_SIZE) -> None:
+    """
+    Создаёт сессию текущего процесса. Вызывается из хука post_fork
+    gunicorn, чтобы размер пула совпадал с числом потоков воркера
+    """
+    global session, session_pid, session_pool_size
+    with session_lock:
+        session_pool_size = pool_size
+        session = create_session(pool_size)
+        session_pid = os.getpid()
+    logger.info("Session with pool of %s connections created", pool_size)
+
+
+def get_session() -> requests.Session:
+    """
+    Возвращает сессию текущего процесса. Соединения пула нельзя делить
+    между процессами, поэтому после fork, например при --preload,
+    сессия создаётся заново
+    """
+    global session, session_pid
+    pid = os.getpid()
+    if session is None or session_pid != pid:
+        with session_lock:
+            if session is None or session_pid != pid:
+                session = create_session(session_pool_size)
+                session_pid = pid
+    return session
+
+
 def get_exchange_rate(currency_signs: str) -> bytes:
     """
     Получает данные от стороннего api для указанных символов валют
     """
-    logger.debug("URL for request: %s", API_URL.format(currency_signs))
-    with requests.get(API_URL.format(currency_signs)) as response:
-        logger.debug("Currency signs: %s", currency_signs)
-        logger.debug("Status code: %s", response.status_code)
+    with get_session().get(
+        API_URL.format(currency_signs),
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    ) as response:
         if response.status_code == 404:
             logger.error("Request error: %s", response.status_code)
             raise ValueError("Currency signs are not valid")
+        response.raise_for_status()
         return response.content
 
 
+def refresh_rate_matrix() -> None:
+    """
+    Обновляет устаревшую таблицу курсов в кеше. При ошибке старая
+    таблица продолжает использоваться до конца окна stale
+    """
+    matrix = None
+    try:
+        matrix = RateMatrix.from_json(get_exchange_rate(BASE_CURRENCY))
+    except Exception as exc:
+        logger.error("Refresh error: %s. Currency signs: %s.", exc, BASE_CURRENCY)
+    finally:
+        rate_cache.end_refresh(BASE_CURRENCY, matrix)
+
+
+def get_rate_matrix() -> tuple[RateMatrix, list[tuple[str, str]]]:
+    """
+    Возвращает таблицу курсов из кеша и заголовки с её состоянием.
+    Из api загружается только таблица BASE_CURRENCY, остальные базы
+    считаются из неё. Устаревшая таблица отдаётся сразу, а обновляется
+    одним фоновым потоком
+    """
+    matrix, state, age = rate_cache.get(BASE_CURRENCY)
+    if state == MISS:
+        matrix = RateMatrix.from_json(get_exchange_rate(BASE_CURRENCY))
+        rate_cache.set(BASE_CURRENCY, matrix)
+    elif state == STALE and rate_cache.begin_refresh(BASE_CURRENCY):
+        threading.Thread(target=refresh_rate_matrix, daemon=True).start()
+    return matrix, cache_headers(state, age)
+
+
 def exception_response(
     start_response,
     status: str,
@@ -123,8 +217,38 @@ def exception_handler(headers):
 
 
 @exception_handler(headers=[("Content-Type", "application/json")])
-def app(environ, start_response, headers=None):
+def exchange_rate_app(environ, start_response, headers=None):
     currency_signs = get_currency_signs(environ)
-    exchange_rate_data = get_exchange_rate(currency_signs)
-    start_response(status="200 OK", headers=headers)
+    target_signs = get_target_signs(environ)
+    started = perf_counter()
+    matrix, extra_headers = get_rate_matrix()
+    exchange_rate_data = matrix.body(currency_signs, target_signs)
+    if ACCESS_KEY in environ:
+        cache = dict(extra_headers)
+        environ[ACCESS_KEY].update(
+            cache=cache["X-Cache"],
+            age=int(cache["Age"]),
+            rates_ms=round((perf_counter() - started) * 1000, 3),
+        )
+    start_response(status="200 OK", headers=headers + extra_headers)
     return [exchange_rate_data]
+
+
+def app(environ, start_response):
+    started = perf_counter()
+    access = {
+        "method": environ.get("REQUEST_METHOD"),
+        "path": environ.get("RAW_URI"),
+        "status": 0,
+    }
+    environ[ACCESS_KEY] = access
+
+    def start_response_with_status(status, headers, exc_info=None):
+        access["status"] = int(status.split()[0])
+        return start_response(status, headers, exc_info)
+
+    try:
+        return exchange_rate_app(environ, start_response_with_status)
+    finally:
+        access["duration_ms"] = round((perf_counter() - started) * 1000, 3)
+        log_access(access)